@@ -0,0 +1,223 @@
+# Description: Vectorized NumPy Kuba engine that steps N independent games in lockstep. Boards are an (N, 7, 7) int8
+# array with per-game turn, capture count, marble count, Zobrist hash, ko hash and winner arrays. One call to step()
+# applies one move per game with the same push, capture, ko and check_winner rules as KubaGame (including the side
+# to move losing when it has no legal moves), and returns the legality masks for the next step. Moves are encoded
+# as cell * 4 + direction, with cell = row * 7 + column and directions in DIRECTIONS order (R, L, F, B), so there
+# are 196 possible moves. Needs numpy, which the rest of the engine does not.
+
+import numpy as np
+
+from zobrist import PIECE_KEYS
+
+ROWS, COLS = 7, 7
+CELLS = ROWS * COLS
+DIRECTIONS = ("R", "L", "F", "B")
+STEPS = {"R": (0, 1), "L": (0, -1), "F": (-1, 0), "B": (1, 0)}
+MOVES = CELLS * len(DIRECTIONS)
+EMPTY, WHITE, BLACK, RED, OFF = 0, 1, 2, 3, 4      # OFF is what a gather reads past the edge of the board
+WIN_CAPTURES = 7
+NO_WINNER = -1
+
+START = np.array([
+    [1, 1, 0, 0, 0, 2, 2],
+    [1, 1, 0, 3, 0, 2, 2],
+    [0, 0, 3, 3, 3, 0, 0],
+    [0, 3, 3, 3, 3, 3, 0],
+    [0, 0, 3, 3, 3, 0, 0],
+    [2, 2, 0, 3, 0, 1, 1],
+    [2, 2, 0, 0, 0, 1, 1],
+], dtype=np.int8)
+
+
+def _build_rays():
+    """Return a (MOVES, 9) table of cell indices for every move: the cell behind the pushed marble, then the pushed
+    marble and every cell in front of it up to the edge, padded with CELLS (off the board)"""
+    rays = np.full((MOVES, 9), CELLS, dtype=np.intp)
+    for cell in range(CELLS):
+        for index, direction in enumerate(DIRECTIONS):
+            d_row, d_column = STEPS[direction]
+            row, column = divmod(cell, COLS)
+            ray = rays[cell * 4 + index]
+            if 0 <= row - d_row < ROWS and 0 <= column - d_column < COLS:
+                ray[0] = (row - d_row) * COLS + column - d_column
+            k = 1
+            while 0 <= row < ROWS and 0 <= column < COLS:
+                ray[k] = row * COLS + column
+                row += d_row
+                column += d_column
+                k += 1
+    return rays
+
+
+RAYS = _build_rays()
+# KEYS[cell, value] is the Zobrist key of a marble, 0 for EMPTY, OFF and the off-board cell
+KEYS = np.zeros((CELLS + 1, 5), dtype=np.uint64)
+for _cell in range(CELLS):
+    for _value, _colour in ((WHITE, "W"), (BLACK, "B"), (RED, "R")):
+        KEYS[_cell, _value] = PIECE_KEYS[_cell][_colour]
+FLAT_KEYS = KEYS.ravel()        # FLAT_KEYS[cell * 5 + value], a cheaper gather than KEYS[cell, value]
+
+
+def encode_move(coords, direction):
+    """Return the move number for pushing the marble at coords in direction"""
+    row, column = coords
+    return (row * COLS + column) * 4 + DIRECTIONS.index(direction)
+
+
+def decode_move(move):
+    """Return the (coords, direction) of a move number"""
+    cell, direction = divmod(int(move), 4)
+    return divmod(cell, COLS), DIRECTIONS[direction]
+
+
+def resolve(path, own):
+    """Work out pushes along gathered rays. path[..., 0] is the cell behind the pushed marble and path[..., 1:] the
+    line in front of it, own the mover's colour broadcast against path[..., 0]. Returns
+    (legal, gap, pushes_off, ejected, shifted, moved) where legal does not yet apply the ko rule"""
+    line = path[..., 1:]
+    free = (line == EMPTY) | (line == OFF)
+    gap = free.argmax(axis=-1)                              # first empty tile or edge in front of the marble
+    end = np.take_along_axis(line, gap[..., None], -1)[..., 0]
+    pushes_off = end == OFF
+    last = np.take_along_axis(line, (gap - 1)[..., None], -1)[..., 0]
+    ejected = np.where(pushes_off, last, EMPTY)
+    shifted = np.concatenate([np.zeros_like(line[..., :1]), line[..., :-1]], axis=-1)
+    moved = (np.arange(line.shape[-1]) <= gap[..., None]) & (line != OFF)  # cells the push writes to
+    legal = (line[..., 0] == own) & ((path[..., 0] == EMPTY) | (path[..., 0] == OFF))
+    legal &= ~(pushes_off & (ejected == own))               # cant push off own marble
+    return legal, gap, pushes_off, ejected, shifted, moved
+
+
+def push_delta(cells, line, shifted, moved):
+    """Return the Zobrist delta of pushes: the keys of the marbles on the moved cells before and after"""
+    cells = cells * 5
+    return np.bitwise_xor.reduce(np.where(moved, FLAT_KEYS[cells + line] ^ FLAT_KEYS[cells + shifted], np.uint64(0)),
+                                 axis=-1)
+
+
+class BatchKubaGame:
+    """N Kuba games advanced together. boards[i] is game i's board using EMPTY/WHITE/BLACK/RED, turn[i] is 0 when
+    Player1 (white) is to move and 1 for Player2, captures[i] holds both players' captured reds, counts[i] the
+    (W, B, R) marbles on the board and winner[i] is 0 or 1 once a player has won, NO_WINNER before"""
+    def __init__(self, n):
+        self.boards = np.repeat(START[None], n, axis=0)
+        self.turn = np.zeros(n, dtype=np.int8)
+        self.captures = np.zeros((n, 2), dtype=np.int16)
+        self.counts = np.tile(np.array([8, 8, 13], dtype=np.int16), (n, 1))
+        self.winner = np.full(n, NO_WINNER, dtype=np.int8)
+        self.zobrist = self.compute_hash()
+        self.ko_hash = np.zeros(n, dtype=np.uint64)         # 0 when no move is ruled out by the ko rule
+
+    @classmethod
+    def from_games(cls, games):
+        """Build a batch from KubaGame or BitboardKubaGame instances. Raises ValueError if a game is not on a 7x7
+        board"""
+        for game in games:
+            size = getattr(game, "size", ROWS)      # BitboardKubaGame is always 7x7
+            if size != ROWS:
+                raise ValueError(f"BatchKubaGame only plays 7x7 games, not {size}x{size}")
+        batch = cls(len(games))
+        values = {"X": EMPTY, "W": WHITE, "B": BLACK, "R": RED}
+        for i, game in enumerate(games):
+            for row in range(ROWS):
+                for column in range(COLS):
+                    batch.boards[i, row, column] = values[game.get_marble((row, column))]
+            batch.turn[i] = 0 if game.get_current_turn() == game.player1 else 1
+            batch.captures[i] = game.get_captured(game.player1), game.get_captured(game.player2)
+            batch.counts[i] = game.get_marble_count()
+            batch.winner[i] = NO_WINNER if game.get_winner() is None else (0 if game.get_winner() == game.player1
+                                                                             else 1)
+            batch.ko_hash[i] = game.ko_hash or 0
+        batch.zobrist = batch.compute_hash()
+        return batch
+
+    def __len__(self):
+        return len(self.boards)
+
+    def compute_hash(self):
+        """Return the Zobrist hash of every board, the same values KubaGame.compute_hash gives"""
+        flat = self.boards.reshape(len(self.boards), CELLS).astype(np.intp)
+        return np.bitwise_xor.reduce(KEYS[np.arange(CELLS), flat], axis=1)
+
+    def padded(self):
+        """Return the boards as (N, CELLS + 1) with the extra cell reading OFF, for gathering rays"""
+        flat = self.boards.reshape(len(self.boards), CELLS)
+        return np.concatenate([flat, np.full((len(flat), 1), OFF, dtype=np.int8)], axis=1)
+
+    def legal_mask(self):
+        """Return an (N, MOVES) bool array of the moves make_move would accept for the side to move in each game"""
+        n = len(self.boards)
+        own = (self.turn + 1).astype(np.int8)
+        games, cells = np.nonzero((self.boards.reshape(n, CELLS) == own[:, None]) & (self.winner == NO_WINNER)[:, None])
+        games = np.repeat(games, 4)                     # only the mover's marbles can move, try all 4 directions
+        moves = (cells[:, None] * 4 + np.arange(4)).ravel()
+        rays = RAYS[moves]
+        paths = self.padded()[games[:, None], rays]
+        legal, _, _, _, shifted, moved = resolve(paths, own[games])
+        ko = self.ko_hash[games] != 0                   # only these games can break the ko rule
+        if ko.any():
+            delta = push_delta(rays[ko, 1:], paths[ko, 1:], shifted[ko], moved[ko])
+            legal[ko] &= (self.zobrist[games[ko]] ^ delta) != self.ko_hash[games[ko]]
+        mask = np.zeros((n, MOVES), dtype=bool)
+        mask[games, moves] = legal
+        return mask
+
+    def step(self, moves):
+        """Apply moves[i] to game i. Games that are over, get a negative move or an illegal move are left unchanged.
+        Returns (applied, legal) with applied the (N,) bool array of games that moved and legal the legal_mask for
+        the next step"""
+        n = len(self.boards)
+        moves = np.asarray(moves, dtype=np.intp)
+        games = np.arange(n)
+        rays = RAYS[np.maximum(moves, 0)]                                       # (N, 9)
+        paths = self.padded()[games[:, None], rays]
+        own = (self.turn + 1).astype(np.int8)
+        legal, gap, pushes_off, ejected, shifted, moved = resolve(paths, own)
+        delta = push_delta(rays[:, 1:], paths[:, 1:], shifted, moved)
+        legal &= (self.ko_hash == 0) | ((self.zobrist ^ delta) != self.ko_hash)  # cant undo the opponent's last move
+        applied = legal & (moves >= 0) & (self.winner == NO_WINNER)
+
+        write = moved & applied[:, None]
+        flat = self.boards.reshape(n, CELLS)
+        flat[np.broadcast_to(games[:, None], write.shape)[write], rays[:, 1:][write]] = shifted[write]
+
+        # the opponent can only recreate the old board by pushing the line straight back: the marble that moved
+        # into the gap must be theirs and have room behind it
+        line = paths[:, 1:]
+        into_gap = np.take_along_axis(line, np.maximum(gap - 1, 0)[:, None], 1)[:, 0]
+        beyond = np.take_along_axis(line, np.minimum(gap + 1, line.shape[1] - 1)[:, None], 1)[:, 0]
+        reversible = ~pushes_off & (into_gap == WHITE + BLACK - own) & ((beyond == EMPTY) | (beyond == OFF))
+        self.ko_hash = np.where(applied, np.where(reversible, self.zobrist, 0), self.ko_hash).astype(np.uint64)
+        self.zobrist = np.where(applied, self.zobrist ^ delta, self.zobrist).astype(np.uint64)
+
+        ejecting = applied & pushes_off
+        mover = self.turn.astype(np.intp)
+        red = ejecting & (ejected == RED)
+        self.captures[games[red], mover[red]] += 1
+        for value in (WHITE, BLACK, RED):
+            self.counts[ejecting & (ejected == value), value - 1] -= 1
+        opponent_left = self.counts[games, 1 - mover]                           # W count for Player2, B for Player1
+        won = ejecting & ((opponent_left == 0) | (self.captures[games, mover] == WIN_CAPTURES))
+        self.winner[won] = self.turn[won]
+        self.turn[applied] ^= 1
+        legal = self.legal_mask()
+        blocked = applied & (self.winner == NO_WINNER) & ~legal.any(axis=1)    # no legal moves loses
+        self.winner[blocked] = 1 - self.turn[blocked]
+        return applied, legal
+
+    def reset(self, mask):
+        """Put the games selected by the (N,) bool mask back to the starting position"""
+        self.boards[mask] = START
+        self.turn[mask] = 0
+        self.captures[mask] = 0
+        self.counts[mask] = (8, 8, 13)
+        self.winner[mask] = NO_WINNER
+        self.zobrist[mask] = self.compute_hash()[mask]
+        self.ko_hash[mask] = 0
+
+
+def sample_moves(legal, rng):
+    """Return one uniformly random legal move per game from an (N, MOVES) legal mask, -1 for games with none"""
+    scores = rng.random(legal.shape) * legal
+    moves = scores.argmax(axis=1)
+    return np.where(legal.any(axis=1), moves, -1)
@@ -0,0 +1,434 @@
+# Description: Benchmark and regression suite for the engine and renderer hot paths. Times make_move for every
+# direction with and without an ejection, get_marble_count, check_winner, update_board, GameState.apply and
+# get_state against cloning a KubaGame (with both pickled sizes), random playout games per second for each engine
+# and, under SDL's dummy video driver, KubaGame.draw and BoardRenderer.draw frame times. A differential harness
+# first plays seeded random games through KubaGame, BitboardKubaGame, GameState.apply and a one game BatchKubaGame
+# (when numpy is installed) and stops with an error if their legal moves, boards, captures, turns or winners ever
+# differ, and a bot replying to TURN_CHANGED events checks that every move is complete when it is announced. With
+# numpy, a record file holding empty records is also replayed through features.record_positions. Results can be
+# written as JSON and compared with a stored baseline, failing when a metric got worse by more than the tolerance.
+#
+#   python bench.py --json results.json
+#   python bench.py --save-baseline baseline.json
+#   python bench.py --baseline baseline.json --tolerance 0.25
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import main as kuba
+from bitboard import BitboardKubaGame
+from main import OK, RAYS, TURN_CHANGED, KubaGame
+from records import RecordReader, RecordWriter
+from state import PLAYERS, GameState
+
+
+def clone(game):
+    """Return a quiet copy of a KubaGame position, with its scene rebuilt"""
+    copy = KubaGame(quiet=True)
+    copy.board = [row[:] for row in game.board]
+    copy.current_turn = game.current_turn
+    copy.player1_points = game.player1_points
+    copy.player2_points = game.player2_points
+    copy.count_marbles()
+    copy.zobrist = copy.compute_hash()
+    copy.update_board()
+    return copy
+
+
+def push_position(direction, eject):
+    """Return a KubaGame where Player1 pushes the white marble at the start of the middle line in direction, moving
+    two reds into a gap or, with eject, pushing off the last of six reds"""
+    game = KubaGame(quiet=True)
+    game.board = [["[ ]"] * kuba.COLS for _ in range(kuba.ROWS)]
+    start = {"R": (3, 0), "L": (3, 6), "F": (6, 3), "B": (0, 3)}[direction]
+    ray = RAYS[direction][start[0]][start[1]]
+    game.board[start[0]][start[1]] = "[W]"
+    for row, column in ray[1:] if eject else ray[1:3]:
+        game.board[row][column] = "[R]"
+    game.board[0][0] = game.board[6][6] = "[B]"     # off the middle lines, so the opponent can still move
+    return clone(game), start
+
+
+def random_positions(count, plies, seed):
+    """Return count quiet KubaGames reached by plies random legal moves, all still undecided"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        game = KubaGame(quiet=True)
+        for _ in range(plies):
+            moves = list(game.legal_moves(game.get_current_turn()))
+            if not moves:
+                break
+            game.make_move(game.get_current_turn(), *rng.choice(moves))
+        if game.get_winner() is None:
+            positions.append(game)
+    return positions
+
+
+def best_of(repeat, run):
+    """Call run() repeat times and return the smallest result"""
+    return min(run() for _ in range(repeat))
+
+
+def per_call(function, calls):
+    """Return the microseconds per call of function() over calls calls"""
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def bench_make_move(results, calls, repeat):
+    for direction in "RLFB":
+        for eject in (False, True):
+            game, start = push_position(direction, eject)
+            if clone(game).make_move(game.player1, start, direction) != OK:
+                raise AssertionError(f"benchmark move {start} {direction} was rejected")
+
+            def run():
+                games = [clone(game) for _ in range(calls)]
+                begin = time.perf_counter()
+                for copy in games:
+                    copy.make_move(copy.player1, start, direction)
+                return (time.perf_counter() - begin) / calls * 1e6
+            results[f"make_move.{direction}.{'eject' if eject else 'push'}"] = (best_of(repeat, run), "us", "lower")
+
+
+def last_mover(game):
+    """Return the player who made the last move, the one check_winner is called for"""
+    return game.player1 if game.get_current_turn() is game.player2 else game.player2
+
+
+def bench_queries(results, calls, repeat):
+    games = random_positions(20, 30, 1)
+    for name, function in (("get_marble_count", lambda game: game.get_marble_count()),
+                           ("check_winner", lambda game: game.check_winner(last_mover(game))),
+                           ("update_board", lambda game: game.update_board()),
+                           ("legal_moves", lambda game: list(game.legal_moves(game.get_current_turn())))):
+        def run():
+            return sum(per_call(lambda: function(game), calls // len(games)) for game in games) / len(games)
+        results[name] = (best_of(repeat, run), "us", "lower")
+
+
+def bench_state(results, calls, repeat):
+    """GameState.apply and snapshot cost against cloning a KubaGame, and the pickled size of each"""
+    games = random_positions(20, 30, 1)
+    states = [game.get_state() for game in games]
+    moves = [next(state.legal_moves()) for state in states]
+
+    def run():
+        return sum(per_call(lambda: state.apply(*move), calls // len(states))
+                   for state, move in zip(states, moves)) / len(states)
+    results["GameState.apply"] = (best_of(repeat, run), "us", "lower")
+    results["get_state"] = (best_of(repeat, lambda: per_call(games[0].get_state, calls)), "us", "lower")
+    results["clone"] = (best_of(repeat, lambda: per_call(lambda: clone(games[0]), calls // 10)), "us", "lower")
+    results["pickle.GameState"] = (len(pickle.dumps(states[0])), "bytes", "lower")
+    results["pickle.KubaGame"] = (len(pickle.dumps(clone(games[0]))), "bytes", "lower")
+
+
+def playouts(make_engine, games, seed):
+    """Return random games played to the end per second, moves picked uniformly from legal_moves"""
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for _ in range(games):
+        game = make_engine()
+        while game.get_winner() is None:
+            moves = list(game.legal_moves(game.get_current_turn()))
+            if not moves:
+                break
+            coords, direction = rng.choice(moves)
+            game.make_move(game.get_current_turn(), coords, direction)
+    return games / (time.perf_counter() - start)
+
+
+def bench_playouts(results, games, repeat):
+    for name, make_engine in (("KubaGame", lambda: KubaGame(quiet=True)), ("BitboardKubaGame", BitboardKubaGame)):
+        results[f"playouts.{name}"] = (max(playouts(make_engine, games, seed) for seed in range(repeat)), "games/s",
+                                       "higher")
+
+
+def bench_draw(results, frames, repeat):
+    """Frame times under the dummy SDL video driver, skipped when pygame is not installed"""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    try:
+        kuba.init_display()
+    except ImportError:
+        print("pygame not installed, skipping draw benchmarks", file=sys.stderr)
+        return
+    game = random_positions(1, 30, 2)[0]
+    results["draw.full"] = (best_of(repeat, lambda: per_call(lambda: game.draw(kuba.WIN), frames)), "us", "lower")
+    renderer = kuba.BoardRenderer(kuba.WIN, game)
+
+    def incremental():
+        renderer.full_redraw = True         # one full repaint, then a push worth of changed cells per frame
+        renderer.draw(game)
+        cells = list(RAYS["R"][3][0][:4])
+        return per_call(lambda: (game.changed_cells.update(cells), renderer.draw(game)), frames)
+    results["draw.incremental"] = (best_of(repeat, incremental), "us", "lower")
+
+
+class StateEngine:
+    """Plays GameState.apply behind the engine interface differential uses. A move by the player not to move is
+    applied with the turn handed to them first, as KubaGame allows"""
+    def __init__(self):
+        self.player1, self.player2 = PLAYERS
+        self.state = GameState.start()
+
+    def as_mover(self, player):
+        """Return the state with player to move"""
+        return self.state._replace(turn=PLAYERS.index(player))
+
+    def legal_moves(self, player):
+        return self.as_mover(player).legal_moves()
+
+    def make_move(self, player, coords, direction):
+        try:
+            self.state = self.as_mover(player).apply(coords, direction)
+        except ValueError as error:
+            return error.args[0]
+        return OK
+
+    def get_marble(self, coords):
+        row, column = coords
+        tile = self.state.board()[row][column]
+        return "X" if tile == "[ ]" else tile[1]
+
+    def get_marble_count(self):
+        return tuple(mask.bit_count() for mask in self.state.masks)
+
+    def get_captured(self, player):
+        return self.state.player1_points if player == self.player1 else self.state.player2_points
+
+    def get_current_turn(self):
+        return self.state.current_player()
+
+    def get_winner(self):
+        return self.state.get_winner()
+
+
+class BatchEngine:
+    """Plays one game in a one slot batch.BatchKubaGame behind the engine interface differential uses, so step and
+    legal_mask are compared with KubaGame move by move"""
+    def __init__(self):
+        import batch
+        self.batch_module = batch
+        self.batch = batch.BatchKubaGame(1)
+        self.player1, self.player2 = PLAYERS
+
+    def legal_moves(self, player):
+        saved = self.batch.turn[0]
+        self.batch.turn[0] = PLAYERS.index(player)
+        mask = self.batch.legal_mask()[0]
+        self.batch.turn[0] = saved
+        return [self.batch_module.decode_move(move) for move in mask.nonzero()[0]]
+
+    def make_move(self, player, coords, direction):
+        """Return OK, or None when the move is rejected, as step gives no reason"""
+        row, column = coords
+        if not 0 <= row < kuba.ROWS or not 0 <= column < kuba.COLS or direction not in self.batch_module.DIRECTIONS:
+            return None
+        saved = self.batch.turn[0]
+        self.batch.turn[0] = PLAYERS.index(player)
+        applied, _ = self.batch.step([self.batch_module.encode_move(coords, direction)])
+        if not applied[0]:
+            self.batch.turn[0] = saved
+            return None
+        return OK
+
+    def get_marble(self, coords):
+        return "XWBR"[self.batch.boards[0][coords]]
+
+    def get_marble_count(self):
+        return tuple(int(count) for count in self.batch.counts[0])
+
+    def get_captured(self, player):
+        return int(self.batch.captures[0, PLAYERS.index(player)])
+
+    def get_current_turn(self):
+        return PLAYERS[self.batch.turn[0]]
+
+    def get_winner(self):
+        winner = self.batch.winner[0]
+        return None if winner == self.batch_module.NO_WINNER else PLAYERS[winner]
+
+
+def differential(engines, games, seed, max_plies=400):
+    """Play seeded random games through a reference KubaGame and every engine in engines (name: factory), with a
+    few random and mostly illegal moves mixed in, and raise AssertionError at the first difference in legal moves,
+    make_move results (OK or the reason a move was rejected, where the engine gives one), boards, captures, turns
+    or winners. Returns the number of moves compared"""
+    compared = 0
+    for game_number in range(games):
+        rng = random.Random(seed + game_number)
+        reference = KubaGame(quiet=True)
+        others = {name: factory() for name, factory in engines.items()}
+        for ply in range(max_plies):
+            player = reference.get_current_turn()
+            moves = sorted(reference.legal_moves(player))
+            for name, engine in others.items():
+                if sorted(engine.legal_moves(player)) != moves:
+                    raise AssertionError(f"{name}: legal moves differ in game {game_number} ply {ply}")
+            if not moves or rng.random() < 0.05:
+                move = ((rng.randrange(7), rng.randrange(7)), rng.choice("RLFB"))
+                player = rng.choice((reference.player1, reference.player2))
+            else:
+                move = rng.choice(moves)
+            expected = reference.make_move(player, *move)
+            for name, engine in others.items():
+                result = engine.make_move(player, *move)
+                if result != expected and (result is not None or expected == OK):    # None: rejected, no reason
+                    raise AssertionError(f"{name} gave {result} for {player} {move} where KubaGame gave {expected} "
+                                         f"in game {game_number} ply {ply}")
+                if state(engine) != state(reference):
+                    raise AssertionError(f"{name}: positions differ after {player} {move} in game {game_number} ply "
+                                         f"{ply}")
+            compared += 1
+            if reference.get_winner() is not None:
+                break
+    return compared
+
+
+def listener_replies(games, seed, max_plies=400):
+    """Play seeded random games where Player2 is a bot replying from a TURN_CHANGED listener, as a client of the
+    events would. At every turn change the listener checks that the move is complete: the board hash, position key,
+    marble counts and legal moves must match a copy rebuilt from scratch. Raises AssertionError at the first stale
+    value and returns the number of turn changes checked"""
+    checked = 0
+    for game_number in range(games):
+        rng = random.Random(seed + game_number)
+        game = KubaGame(quiet=True)
+
+        def on_event(event, data):
+            nonlocal checked
+            if event != TURN_CHANGED:
+                return
+            rebuilt = KubaGame.from_state(game.get_state(), quiet=True)
+            player = data["player"]
+            if (game.zobrist != game.compute_hash() or game.position_key() != rebuilt.position_key()
+                    or game.get_marble_count() != rebuilt.get_marble_count()
+                    or sorted(game.legal_moves(player)) != sorted(rebuilt.legal_moves(player))):
+                raise AssertionError(f"TURN_CHANGED sent before the move was complete in game {game_number}")
+            checked += 1
+            if player is game.player2 and game.get_winner() is None:
+                game.make_move(player, *rng.choice(list(game.legal_moves(player))))
+        game.subscribe(on_event)
+        for _ in range(max_plies):
+            if game.get_winner() is not None:
+                break
+            game.make_move(game.player1, *rng.choice(list(game.legal_moves(game.player1))))
+        if game.zobrist != game.compute_hash():
+            raise AssertionError(f"board hash out of date after replies from a listener in game {game_number}")
+    return checked
+
+
+def empty_records(games, seed, max_plies=40):
+    """Write seeded random games to a record file with an empty record (a game attached and closed before any move)
+    before and after each one, then replay it through features.record_positions. Raises AssertionError unless every
+    recorded move comes back once, and returns the number of positions"""
+    from features import record_positions
+    expected = 0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "empty.kuba")
+        with RecordWriter(path) as writer:
+            for game_number in range(games):
+                rng = random.Random(seed + game_number)
+                writer.attach(KubaGame(quiet=True))
+                game = KubaGame(quiet=True)
+                writer.attach(game)
+                for _ in range(rng.randrange(1, max_plies)):
+                    moves = list(game.legal_moves(game.get_current_turn()))
+                    if game.get_winner() is not None or not moves:
+                        break
+                    game.make_move(game.get_current_turn(), *rng.choice(moves))
+                    expected += 1
+            writer.attach(KubaGame(quiet=True))
+        with RecordReader(path) as reader:
+            positions = sum(len(features) for features, _, _ in record_positions(reader, 4))
+    if positions != expected:
+        raise AssertionError(f"record_positions gave {positions} positions for {expected} recorded moves")
+    return positions
+
+
+def state(engine):
+    """Return everything the differential harness compares"""
+    return ([engine.get_marble((row, column)) for row in range(kuba.ROWS) for column in range(kuba.COLS)],
+            engine.get_marble_count(), engine.get_captured(engine.player1), engine.get_captured(engine.player2),
+            engine.get_current_turn(), engine.get_winner())
+
+
+def compare(results, baseline, tolerance):
+    """Print each metric against the baseline and return the names that got worse by more than tolerance"""
+    regressions = []
+    for name, (value, unit, better) in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<24} {value:>12.2f} {unit:<8} (new)")
+            continue
+        change = (value - old["value"]) / old["value"] if old["value"] else 0.0
+        worse = change > tolerance if better == "lower" else change < -tolerance
+        print(f"{name:<24} {value:>12.2f} {unit:<8} baseline {old['value']:>12.2f} {change:+7.1%}"
+              f"{'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kuba engine and renderer benchmarks")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare with results saved by --save-baseline, exit 1 on regressions")
+    parser.add_argument("--save-baseline", help="write the results to this file as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="fraction a metric may get worse by")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, for a smoke test")
+    parser.add_argument("--diff-games", type=int, default=50, help="games for the differential check")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    calls, repeat, games, frames = (200, 2, 5, 20) if args.quick else (2000, 5, 30, 200)
+    engines = {"BitboardKubaGame": BitboardKubaGame, "GameState": StateEngine}
+    try:
+        import numpy                        # noqa: F401, only the batch engine needs it
+        engines["BatchKubaGame"] = BatchEngine
+        print(f"records: {empty_records(args.diff_games, args.seed)} positions replayed around empty records")
+    except ImportError:
+        print("numpy not installed, skipping BatchKubaGame and the records check", file=sys.stderr)
+    start = time.perf_counter()
+    compared = differential(engines, args.diff_games, args.seed)
+    print(f"differential: {compared} moves identical across KubaGame and {', '.join(engines)} "
+          f"in {time.perf_counter() - start:.1f}s")
+    print(f"listeners: {listener_replies(args.diff_games, args.seed)} turn changes complete when announced")
+
+    results = {}
+    bench_make_move(results, calls, repeat)
+    bench_queries(results, calls, repeat)
+    bench_state(results, calls, repeat)
+    bench_playouts(results, games, repeat)
+    bench_draw(results, frames, repeat)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+
+    report = {"python": platform.python_version(), "machine": platform.machine(), "quick": args.quick,
+              "results": {name: {"value": value, "unit": unit, "better": better}
+                          for name, (value, unit, better) in results.items()}}
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+    if regressions:
+        print(f"{len(regressions)} regressions: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Description: Perft benchmark for the Kuba engines. Counts the positions reachable in exactly N plies from the
+# starting position and from a set of seeded random midgame positions, checks that every engine reports the same
+# counts as the reference KubaGame and prints nodes per second for each engine.
+#
+#   python bench_perft.py --depth 3 --positions 5 --plies 20
+
+import argparse
+import random
+import time
+
+from bitboard import BitboardKubaGame
+from main import KubaGame
+from zobrist import TranspositionTable
+
+
+def midgame_positions(count, plies, seed):
+    """Return count KubaGame positions reached by playing plies random legal moves from the start"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        game = KubaGame(quiet=True)
+        for _ in range(plies):
+            moves = list(game.legal_moves(game.get_current_turn()))
+            if not moves:
+                break
+            coords, direction = rng.choice(moves)
+            game.make_move(game.get_current_turn(), coords, direction)
+        if game.get_winner() is None:
+            positions.append(game)
+    return positions
+
+
+def run_perft(engine, depth, table=None):
+    """Return (nodes, seconds) for a perft of depth on engine"""
+    start = time.perf_counter()
+    nodes = engine.perft(depth, table)
+    return nodes, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft node counts and speed for every Kuba engine")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--positions", type=int, default=5, help="number of midgame positions")
+    parser.add_argument("--plies", type=int, default=20, help="random plies played to reach a midgame position")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tt-size", type=int, default=0, help="cache subtree counts in a transposition table")
+    args = parser.parse_args()
+
+    positions = [("start", KubaGame(quiet=True))]
+    positions += [(f"mid{i}", game) for i, game in enumerate(midgame_positions(args.positions, args.plies, args.seed))]
+    engines = [("KubaGame", lambda game: game), ("BitboardKubaGame", BitboardKubaGame.from_game)]
+
+    totals = {name: [0, 0.0] for name, _ in engines}
+    mismatches = 0
+    for label, game in positions:
+        reference = None
+        for name, build in engines:
+            table = TranspositionTable(args.tt_size) if args.tt_size else None
+            nodes, seconds = run_perft(build(game), args.depth, table)
+            totals[name][0] += nodes
+            totals[name][1] += seconds
+            if reference is None:
+                reference = nodes
+            elif nodes != reference:
+                mismatches += 1
+                print(f"MISMATCH {label}: {name} counted {nodes}, expected {reference}")
+            print(f"{label:>6} {name:<18} perft({args.depth}) = {nodes:>9}  {nodes / seconds:>12,.0f} nodes/s"
+                  + (f"  tt hit rate {table.hit_rate():.1%}" if table else ""))
+
+    for name, (nodes, seconds) in totals.items():
+        print(f"total  {name:<18} {nodes:>9} nodes in {seconds:.3f}s  {nodes / seconds:>12,.0f} nodes/s")
+    if mismatches:
+        raise SystemExit(f"{mismatches} perft mismatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+# Description: Bitboard version of the KubaGame rules engine. The board is kept as one 49-bit integer mask per colour
+# (W, B, R) with bit (row * 7 + column) set when that colour has a marble on the cell. Pushes are resolved with
+# masks and shifts instead of string compares and list slicing, and ejections are found with precomputed
+# file/rank masks. Exposes the same make_move(player, coords, direction), get_marble, get_marble_count and
+# get_captured results as KubaGame in main.py, without printing.
+
+from state import BAD_DIRECTION, EMPTY_TILE, GAME_OVER, KO, NO_ROOM, OFF_BOARD, OK, OPPONENT_MARBLE, OWN_MARBLE, \
+    RED_MARBLE
+from zobrist import PIECE_KEYS, position_key
+
+ROWS, COLS = 7, 7
+FULL = (1 << (ROWS * COLS)) - 1
+
+FILE_0 = sum(1 << (row * COLS) for row in range(ROWS))                 # column 0
+FILE_6 = FILE_0 << (COLS - 1)                                           # column 6
+RANK_0 = (1 << COLS) - 1                                                # row 0
+RANK_6 = RANK_0 << (COLS * (ROWS - 1))                                  # row 6
+
+# cells a marble falls off the board from when pushed in that direction
+EDGE = {"R": FILE_6, "L": FILE_0, "F": RANK_0, "B": RANK_6}
+OPPOSITE = {"R": "L", "L": "R", "F": "B", "B": "F"}
+STEP = {"R": 1, "L": -1, "F": -COLS, "B": COLS}                         # change in bit index for one cell
+
+
+def bit(row, column):
+    """Return the mask with only the (row, column) cell set"""
+    return 1 << (row * COLS + column)
+
+
+SHIFTS = {
+    "R": lambda mask: (mask & ~FILE_6) << 1,
+    "L": lambda mask: (mask & ~FILE_0) >> 1,
+    "F": lambda mask: (mask & ~RANK_0) >> COLS,             # forward is towards row 0
+    "B": lambda mask: ((mask & ~RANK_6) << COLS) & FULL,    # back is towards row 6
+}
+
+
+def shift(mask, direction):
+    """Move every marble in mask one cell in direction. Marbles on the edge in that direction fall off"""
+    mover = SHIFTS.get(direction)
+    return mover(mask) if mover is not None else 0
+
+
+def _build_masks():
+    """Return (rays, behind): rays[direction][index] is the mask of the cells from bit index to the edge in
+    direction, the cell itself included, and behind[direction][index] the cell that must be empty to push from
+    there, 0 on the edge"""
+    rays, behind = {}, {}
+    for direction in EDGE:
+        rays[direction], behind[direction] = [], []
+        for index in range(ROWS * COLS):
+            square = 1 << index
+            ray = last = square
+            while not last & EDGE[direction]:
+                last = shift(last, direction)
+                ray |= last
+            rays[direction].append(ray)
+            behind[direction].append(shift(square, OPPOSITE[direction]))
+    return rays, behind
+
+
+RAYS, BEHIND = _build_masks()
+UPWARD = {"R": True, "L": False, "F": False, "B": True}    # pushes towards higher bit indices
+
+
+def line_from(square, direction, occupied):
+    """Return (line, last) for pushing the marble on square in direction on a board with the occupied mask, see
+    BitboardKubaGame.push_line. The line runs along the precomputed ray up to the first gap, the nearest empty ray
+    cell being the lowest or highest set bit of the ray's empty cells depending on the direction"""
+    ray = RAYS[direction][square.bit_length() - 1]
+    gaps = ray & ~occupied
+    if UPWARD[direction]:
+        line = ray & ((gaps & -gaps) - 1) if gaps else ray
+        return line, 1 << (line.bit_length() - 1)
+    line = ray & -(1 << gaps.bit_length()) if gaps else ray    # the ray cells above the highest gap
+    return line, line & -line
+
+
+class BitboardKubaGame:
+    """Kuba rules engine on three bitboards. Same players, turn order and win rules as KubaGame"""
+    def __init__(self):
+        """initializes with the standard starting layout, 8 white/black marbles and 13 red marbles"""
+        self.player1, self.colorA = ('Player1', 'W')
+        self.player2, self.colorB = ('Player2', 'B')
+        self.white = bit(0, 0) | bit(0, 1) | bit(1, 0) | bit(1, 1) | bit(5, 5) | bit(5, 6) | bit(6, 5) | bit(6, 6)
+        self.black = bit(0, 5) | bit(0, 6) | bit(1, 5) | bit(1, 6) | bit(5, 0) | bit(5, 1) | bit(6, 0) | bit(6, 1)
+        self.red = (bit(1, 3) | bit(2, 2) | bit(2, 3) | bit(2, 4) | bit(3, 1) | bit(3, 2) | bit(3, 3) | bit(3, 4)
+                    | bit(3, 5) | bit(4, 2) | bit(4, 3) | bit(4, 4) | bit(5, 3))
+        self.current_turn = self.player1
+        self.player1_points = 0
+        self.player2_points = 0
+        self.winner = None
+        self.undo_stack = []
+        self.zobrist = self.compute_hash()
+        self.ko_hash = None     # board hash the next move can not recreate, same as KubaGame.ko_hash
+
+    @classmethod
+    def from_game(cls, game):
+        """Build a bitboard engine holding the same position, points, turn and winner as a KubaGame. Raises ValueError
+        unless the game is on a 7x7 board"""
+        if game.size != ROWS:
+            raise ValueError(f"the bitboard engine only plays 7x7 games, not {game.size}x{game.size}")
+        engine = cls()
+        engine.white = engine.black = engine.red = 0
+        for row in range(ROWS):
+            for column in range(COLS):
+                tile = game.board[row][column]
+                if tile == "[W]":
+                    engine.white |= bit(row, column)
+                elif tile == "[B]":
+                    engine.black |= bit(row, column)
+                elif tile == "[R]":
+                    engine.red |= bit(row, column)
+        engine.current_turn = game.current_turn
+        engine.player1_points = game.player1_points
+        engine.player2_points = game.player2_points
+        engine.winner = game.winner
+        engine.zobrist = engine.compute_hash()
+        engine.ko_hash = game.ko_hash
+        return engine
+
+    def compute_hash(self):
+        """Return the Zobrist hash of the board, the same value KubaGame.compute_hash gives"""
+        board_hash = 0
+        for colour, mask in (("W", self.white), ("B", self.black), ("R", self.red)):
+            while mask:
+                square = mask & -mask
+                mask ^= square
+                board_hash ^= PIECE_KEYS[square.bit_length() - 1][colour]
+        return board_hash
+
+    def push_hash(self, line, direction):
+        """Return the board hash after every marble in line moves one cell in direction"""
+        board_hash = self.zobrist
+        edge = EDGE[direction]
+        step = STEP[direction]
+        for colour, mask in (("W", self.white), ("B", self.black), ("R", self.red)):
+            moving = mask & line
+            while moving:
+                square = moving & -moving
+                moving ^= square
+                index = square.bit_length() - 1
+                board_hash ^= PIECE_KEYS[index][colour]
+                if not square & edge:
+                    board_hash ^= PIECE_KEYS[index + step][colour]
+        return board_hash
+
+    def is_ko(self, board_hash):
+        """Return True if a move giving board_hash would recreate the board from before the opponent's last move"""
+        return board_hash == self.ko_hash
+
+    def position_key(self):
+        """Return the transposition table key of the current position, the same value KubaGame.position_key gives"""
+        return position_key(self.zobrist, self.current_turn == self.player2, self.player1_points,
+                            self.player2_points, self.ko_hash or 0)
+
+    def get_current_turn(self):
+        """Returns current turn"""
+        return self.current_turn
+
+    def get_winner(self):
+        """Return the winner"""
+        return self.winner
+
+    def get_captured(self, player):
+        """Return how many points the player has"""
+        if player == self.player1:
+            return self.player1_points
+        if player == self.player2:
+            return self.player2_points
+        return "invalid player"
+
+    def get_marble(self, coords):
+        """Return whatever marble is in coords, X for an empty tile and None for coords off the board"""
+        row, column = coords
+        if not 0 <= row < ROWS or not 0 <= column < COLS:
+            return
+        square = bit(row, column)
+        if self.white & square:
+            return "W"
+        if self.black & square:
+            return "B"
+        if self.red & square:
+            return "R"
+        return "X"
+
+    def get_marble_count(self):
+        """Return a (W, B, R) tuple of the marbles left on the board"""
+        return self.white.bit_count(), self.black.bit_count(), self.red.bit_count()
+
+    def print_board(self):
+        """Print the board in the same format as KubaGame.print_board"""
+        for row in range(ROWS):
+            print(*("[ ]" if self.get_marble((row, column)) == "X" else f"[{self.get_marble((row, column))}]"
+                    for column in range(COLS)))
+        print("")
+
+    def own_mask(self, player):
+        """Return the bitboard of the marbles player is allowed to move"""
+        if player == self.player1:
+            return self.white
+        if player == self.player2:
+            return self.black
+        return 0
+
+    def push_line(self, square, direction):
+        """Return (line, last) for a push of the marble on square: the mask of every marble that moves and the
+        square of the one at the far end. last is ejected when it sits on the EDGE mask for direction"""
+        return line_from(square, direction, self.white | self.black | self.red)
+
+    def make_move(self, player, coords, direction):
+        """Push the player's marble at coords in direction ("L", "R", "F" or "B"). Returns OK if successful,
+        otherwise the reason the move cant be made, the same result KubaGame.make_move gives"""
+        if self.winner is not None:
+            return GAME_OVER
+        row, column = coords
+        if not 0 <= row < ROWS or not 0 <= column < COLS:
+            return OFF_BOARD
+        square = bit(row, column)
+        own = self.own_mask(player)
+        if not own & square:
+            if self.red & square:
+                return RED_MARBLE
+            return OPPONENT_MARBLE if (self.white | self.black) & square else EMPTY_TILE
+        if direction not in EDGE:
+            return BAD_DIRECTION
+        if BEHIND[direction][row * COLS + column] & (self.white | self.black | self.red):
+            return NO_ROOM                      # no room to move marble
+        line, last = self.push_line(square, direction)
+        ejected = last & EDGE[direction]
+        if ejected and own & last:              # cant push off own marble
+            return OWN_MARBLE
+        board_hash = self.push_hash(line, direction)
+        if self.is_ko(board_hash):              # cant undo the opponent's last move
+            return KO
+
+        captured_red = ejected and self.red & last
+        self.white = (self.white & ~line) | shift(self.white & line, direction)
+        self.black = (self.black & ~line) | shift(self.black & line, direction)
+        self.red = (self.red & ~line) | shift(self.red & line, direction)
+        if captured_red:
+            if player == self.player1:
+                self.player1_points += 1
+            else:
+                self.player2_points += 1
+
+        # the opponent can only recreate the old board by pushing the line straight back, which needs the marble
+        # that moved into the gap to be theirs and room behind it
+        gap = shift(last, direction)
+        opponent = self.black if player == self.player1 else self.white
+        if not ejected and gap & opponent and not shift(gap, direction) & (self.white | self.black | self.red):
+            self.ko_hash = self.zobrist
+        else:
+            self.ko_hash = None
+        self.zobrist = board_hash
+        self.current_turn = self.player2 if player == self.player1 else self.player1
+        self.check_winner(player)
+        return OK
+
+    def ejects(self, coords, direction):
+        """Return the marble ("W", "B" or "R") a legal move at coords in direction pushes off the board, or None"""
+        line, last = self.push_line(bit(*coords), direction)
+        if not last & EDGE[direction]:
+            return None
+        index = last.bit_length() - 1
+        return self.get_marble((index // COLS, index % COLS))
+
+    def legal_moves(self, player):
+        """Generator yielding every (coords, direction) that make_move would accept for player"""
+        if self.winner is not None:
+            return
+        own = self.own_mask(player)
+        occupied = self.white | self.black | self.red
+        remaining = own
+        while remaining:
+            square = remaining & -remaining
+            remaining ^= square
+            index = square.bit_length() - 1
+            for direction in ("R", "L", "F", "B"):
+                if BEHIND[direction][index] & occupied:
+                    continue
+                ray = RAYS[direction][index]
+                if not ray & ~occupied and own & ray & EDGE[direction]:    # no gap: the edge marble falls off
+                    continue
+                if self.ko_hash is not None and self.is_ko(self.push_hash(self.push_line(square, direction)[0],
+                                                                          direction)):
+                    continue
+                yield (index // COLS, index % COLS), direction
+
+    def push_move(self, player, coords, direction):
+        """make_move that saves the masks, points, turn and winner so pop_move can restore them"""
+        saved = (self.white, self.black, self.red, self.player1_points, self.player2_points, self.current_turn,
+                 self.winner, self.zobrist, self.ko_hash)
+        if self.make_move(player, coords, direction) != OK:
+            return False
+        self.undo_stack.append(saved)
+        return True
+
+    def pop_move(self):
+        """Undo the last push_move"""
+        (self.white, self.black, self.red, self.player1_points, self.player2_points, self.current_turn,
+         self.winner, self.zobrist, self.ko_hash) = self.undo_stack.pop()
+
+    def perft(self, depth, table=None):
+        """Count the positions reached after exactly depth plies of legal moves, same as KubaGame.perft"""
+        if depth == 0:
+            return 1
+        if table is not None:
+            key = self.position_key()
+            entry = table.probe(key)
+            if entry is not None and entry[1] == depth:
+                return entry[2]
+        moves = list(self.legal_moves(self.current_turn))
+        if depth == 1:
+            nodes = len(moves)
+        else:
+            nodes = 0
+            for coords, direction in moves:
+                self.push_move(self.current_turn, coords, direction)
+                nodes += self.perft(depth - 1, table)
+                self.pop_move()
+        if table is not None:
+            table.store(key, depth, nodes)
+        return nodes
+
+    def has_legal_move(self, player):
+        """Return True if player has at least one legal move"""
+        return next(self.legal_moves(player), None) is not None
+
+    def check_winner(self, player):
+        """Set player as the winner if no opposing marbles are left, they captured 7 red marbles or the opponent has
+        no legal moves left"""
+        opponent = self.black if player == self.player1 else self.white
+        if not opponent or self.get_captured(player) == 7 or not self.has_legal_move(self.current_turn):
+            self.winner = player
@@ -0,0 +1,170 @@
+# Description: Batched feature extraction for training evaluation functions. extract turns every position of a
+# BatchKubaGame into a contiguous (N, len(PLANES), 7, 7) array in one call, straight from the int8 boards: occupancy
+# planes, mobility per marble, which marbles and reds can be pushed off, the side to move and both capture counts.
+# Planes are relative to the side to move, so both colours look the same to a model. record_positions replays a
+# record file (see records.py) in a BatchKubaGame and yields the features of every position with the move played
+# and the game's outcome, a fixed number of games at a time, so memory stays flat however large the archive is.
+# Needs numpy, like batch.py.
+#
+#   python features.py games.kuba --games 512
+
+import argparse
+import time
+
+import numpy as np
+
+from batch import BLACK, CELLS, COLS, EMPTY, NO_WINNER, OFF, RAYS, RED, ROWS, WHITE, WIN_CAPTURES, \
+    BatchKubaGame, push_delta, resolve
+from records import PASS, RESULTS, RecordReader
+
+PLANES = (
+    "own",                  # the side to move's marbles
+    "opponent",             # the opponent's marbles
+    "red",
+    "empty",
+    "own_mobility",         # legal directions of each of the mover's marbles, 0 to 4, with the ko rule
+    "opponent_mobility",    # the same for the opponent's marbles if it were their turn, without the ko rule
+    "own_exposed",          # the mover's marbles the opponent could push off
+    "opponent_exposed",     # the opponent's marbles the mover can push off
+    "own_red_reach",        # reds the mover can push off
+    "opponent_red_reach",   # reds the opponent could push off
+    "player2_to_move",      # all ones when Player2 (black) is to move
+    "own_captures",         # all set to the mover's captured reds / WIN_CAPTURES
+    "opponent_captures",    # all set to the opponent's captured reds / WIN_CAPTURES
+)
+PLANE = {name: index for index, name in enumerate(PLANES)}
+
+
+def pushes(paths, flat, colour):
+    """Work out every push by the marbles of colour ((N,) int8) on the flat (N, CELLS) boards, paths being the boards
+    padded with an OFF cell. Returns (games, cells, legal, target, ejected, rays, shifted, moved), one entry per
+    marble and direction in DIRECTIONS order: legal ignores the ko rule and target is the cell index of the marble a
+    legal move pushes off, CELLS when it pushes none. Only the marbles of colour are gathered, like legal_mask"""
+    games, cells = np.nonzero(flat == colour[:, None])
+    games = np.repeat(games, 4)
+    rays = RAYS[(cells[:, None] * 4 + np.arange(4)).ravel()]
+    legal, gap, pushes_off, ejected, shifted, moved = resolve(paths[games[:, None], rays], colour[games])
+    last = np.take_along_axis(rays[:, 1:], np.maximum(gap - 1, 0)[:, None], 1)[:, 0]
+    target = np.where(legal & pushes_off, last, CELLS)
+    return games, cells, legal, target, ejected, rays, shifted, moved
+
+
+def extract(batch, rows=None, dtype=np.float32):
+    """Return the PLANES features of the games in a BatchKubaGame, or only of the games in rows (an index array), as
+    a C-contiguous (N, len(PLANES), ROWS, COLS) array. Use BatchKubaGame.from_games for a list of 7x7 KubaGames"""
+    if rows is None:
+        rows = np.arange(len(batch))
+    n = len(rows)
+    flat = batch.boards[rows].reshape(n, CELLS)
+    turn = batch.turn[rows].astype(np.intp)
+    own = (turn + WHITE).astype(np.int8)
+    opponent = (WHITE + BLACK - own).astype(np.int8)
+    captures = batch.captures[rows]
+    zobrist, ko_hash = batch.zobrist[rows], batch.ko_hash[rows]
+
+    out = np.zeros((n, len(PLANES), CELLS + 1), dtype)     # the extra cell takes marks for moves ejecting nothing
+    out[:, PLANE["own"], :CELLS] = flat == own[:, None]
+    out[:, PLANE["opponent"], :CELLS] = flat == opponent[:, None]
+    out[:, PLANE["red"], :CELLS] = flat == RED
+    out[:, PLANE["empty"], :CELLS] = flat == EMPTY
+    paths = np.concatenate([flat, np.full((n, 1), OFF, dtype=np.int8)], axis=1)
+
+    games, cells, legal, target, ejected, rays, shifted, moved = pushes(paths, flat, own)
+    ko = ko_hash[games] != 0                                # only these games have a move ruled out by the ko rule
+    if ko.any():
+        delta = push_delta(rays[ko, 1:], paths[games[ko, None], rays[ko, 1:]], shifted[ko], moved[ko])
+        legal[ko] &= (zobrist[games[ko]] ^ delta) != ko_hash[games[ko]]
+        target[ko] = np.where(legal[ko], target[ko], CELLS)
+    out[games[::4], PLANE["own_mobility"], cells] = legal.reshape(-1, 4).sum(axis=1)
+    # every move with the same target pushes off the same marble, so repeated cells are all written the same value
+    out[games, PLANE["opponent_exposed"], target] = ejected == opponent[games]
+    out[games, PLANE["own_red_reach"], target] = ejected == RED
+
+    games, cells, legal, target, ejected, _, _, _ = pushes(paths, flat, opponent)
+    out[games[::4], PLANE["opponent_mobility"], cells] = legal.reshape(-1, 4).sum(axis=1)
+    out[games, PLANE["own_exposed"], target] = ejected == own[games]
+    out[games, PLANE["opponent_red_reach"], target] = ejected == RED
+
+    games = np.arange(n)
+    out[:, PLANE["player2_to_move"]] = turn[:, None]
+    out[:, PLANE["own_captures"]] = (captures[games, turn] / WIN_CAPTURES)[:, None]
+    out[:, PLANE["opponent_captures"]] = (captures[games, 1 - turn] / WIN_CAPTURES)[:, None]
+    return np.ascontiguousarray(out[:, :, :CELLS]).reshape(n, len(PLANES), ROWS, COLS)
+
+
+def load(record):
+    """Return (moves, turns, winner) for a GameRecord: the move numbers without PASS bytes, the side (0 or 1) making
+    each one and the winner's side or NO_WINNER"""
+    data = np.frombuffer(record.moves, dtype=np.uint8)
+    index = np.flatnonzero(data != PASS)
+    winner = RESULTS.index(record.winner) - 1           # RESULTS is (None, "Player1", "Player2")
+    return data[index].astype(np.intp), (index % 2).astype(np.int8), winner
+
+
+def record_positions(reader, games=256, dtype=np.float32):
+    """Generator replaying every game of a RecordReader in a BatchKubaGame of games slots, a finished game's slot
+    being refilled with the next record that has any moves. Yields (features, moves, outcomes) per ply for the
+    positions before each move: the extract features, the batch move numbers played and 1, -1 or 0 for a win, loss
+    or undecided game from the side to move's point of view. Raises ValueError if a recorded move is illegal"""
+    records = iter(reader)
+    batch = BatchKubaGame(games)
+    slots = [None] * games          # (moves, turns, winner, offset) of the record being replayed in each slot
+    ply = np.zeros(games, dtype=np.intp)
+
+    def refill(slot):
+        slots[slot] = None
+        for record in records:
+            moves, turns, winner = load(record)
+            if len(moves):              # RecordWriter ends a game attached and closed before any move with no moves
+                slots[slot] = moves, turns, winner, record.offset
+                break
+        ply[slot] = 0
+
+    for slot in range(games):
+        refill(slot)
+    while True:
+        rows = np.array([slot for slot in range(games) if slots[slot] is not None], dtype=np.intp)
+        if not len(rows):
+            return
+        moves = np.full(games, -1, dtype=np.intp)
+        winner = np.full(games, NO_WINNER, dtype=np.int8)
+        for slot in rows:
+            slot_moves, turns, winner[slot], _ = slots[slot]
+            moves[slot] = slot_moves[ply[slot]]
+            batch.turn[slot] = turns[ply[slot]]         # a PASS can give the same side two moves in a row
+        features = extract(batch, rows, dtype)
+        outcomes = np.where(winner[rows] == NO_WINNER, 0, np.where(winner[rows] == batch.turn[rows], 1, -1))
+        applied, _ = batch.step(moves)
+        rejected = rows[~applied[rows]]
+        if len(rejected):
+            slot = rejected[0]
+            raise ValueError(f"game at byte {slots[slot][3]}: move {ply[slot]} is illegal")
+        yield features, moves[rows], outcomes.astype(np.int8)
+
+        ply[rows] += 1
+        finished = np.array([len(slots[slot][0]) == ply[slot] for slot in rows], dtype=bool)
+        if finished.any():
+            reset = np.zeros(games, dtype=bool)
+            reset[rows[finished]] = True
+            batch.reset(reset)
+            for slot in rows[finished]:
+                refill(slot)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract features from every position of a Kuba record file")
+    parser.add_argument("path")
+    parser.add_argument("--games", type=int, default=256, help="games replayed side by side")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    positions = 0
+    with RecordReader(args.path) as reader:
+        for features, _, _ in record_positions(reader, args.games):
+            positions += len(features)
+    elapsed = time.perf_counter() - start
+    print(f"{positions} positions x {len(PLANES)} planes in {elapsed:.2f}s: {positions / elapsed:,.0f} positions/s")
+
+
+if __name__ == "__main__":
+    main()
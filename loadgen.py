@@ -0,0 +1,160 @@
+# Description: Load generator for server.py. Opens one connection per session as the host (playing both sides),
+# then every session plays random legal moves, picked from a quiet local KubaGame that follows the server's
+# replies, as fast as the server answers. Starts a new session when a game ends. Reports moves per second and the
+# p50/p90/p99/max latency from sending a move to receiving its broadcast. With --idle-timeout it then checks that
+# the server evicts an idle finished game and, after that, an idle session joined later.
+#
+#   python loadgen.py --spawn --sessions 1000 --seconds 20
+#   python loadgen.py --spawn --sessions 50 --seconds 2 --idle-timeout 0.4
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from main import OK, KubaGame
+from server import DEFAULT_PORT
+
+
+async def play(host, port, index, deadline, latencies, counts, seed):
+    """Play games on the server until deadline, appending move round trip times in seconds to latencies"""
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 16)
+    game_number = 0
+    try:
+        while time.perf_counter() < deadline:
+            session = f"load-{index}-{game_number}"
+            game_number += 1
+            writer.write(json.dumps({"cmd": "join", "session": session, "role": "host"}).encode() + b"\n")
+            reply = json.loads(await reader.readline())
+            if reply.get("type") != "joined":
+                counts["errors"] += 1
+                return
+            if not await play_game(reader, writer, rng, deadline, latencies, counts):
+                return
+    except (ConnectionError, ValueError):
+        counts["errors"] += 1
+    finally:
+        writer.close()
+
+
+async def play_game(reader, writer, rng, deadline, latencies, counts):
+    """Play random moves in the session the connection has joined until the game ends or deadline. Returns False
+    after counting an error"""
+    game = KubaGame(quiet=True)
+    while game.get_winner() is None and time.perf_counter() < deadline:
+        moves = list(game.legal_moves(game.get_current_turn()))
+        if not moves:
+            break
+        (row, column), direction = rng.choice(moves)
+        start = time.perf_counter()
+        writer.write(json.dumps({"cmd": "move", "row": row, "col": column, "direction": direction}).encode() + b"\n")
+        reply = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        if reply.get("type") != "moved":
+            counts["errors"] += 1
+            return False
+        if game.make_move(game.get_current_turn(), (row, column), direction) != OK:
+            counts["errors"] += 1
+            return False
+        counts["moves"] += 1
+    if game.get_winner() is not None:
+        counts["games"] += 1
+    return True
+
+
+async def evicted(host, port, session, idle_timeout, seed, finish):
+    """Join session as the host, play it to the end first if finish, then stay idle and return True if the server
+    evicts the session within a few eviction rounds"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(json.dumps({"cmd": "join", "session": session, "role": "host"}).encode() + b"\n")
+        if json.loads(await reader.readline()).get("type") != "joined":
+            return False
+        counts = {"moves": 0, "games": 0, "errors": 0}
+        if finish and not await play_game(reader, writer, random.Random(seed), float("inf"), [], counts):
+            return False
+        while True:
+            line = await asyncio.wait_for(reader.readline(), idle_timeout * 2 + min(idle_timeout / 4, 5.0) + 1)
+            if not line:
+                return False
+            if json.loads(line).get("type") == "evicted":
+                return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        writer.close()
+
+
+async def check_eviction(host, port, idle_timeout, seed):
+    """Check that a finished game its players stayed in is evicted, and that sessions joined after it still are,
+    which fails if evicting the first one stopped the server's eviction loop. Returns True if both were evicted"""
+    finished = await evicted(host, port, f"evict-finished-{seed}", idle_timeout, seed, True)
+    later = await evicted(host, port, f"evict-idle-{seed}", idle_timeout, seed, False)
+    print(f"eviction: finished game {'evicted' if finished else 'NOT evicted'}, later session "
+          f"{'evicted' if later else 'NOT evicted'}")
+    return finished and later
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, len(ordered) * p // 100)] if ordered else 0.0
+
+
+async def run(host, port, sessions, seconds, seed):
+    latencies = []
+    counts = {"moves": 0, "games": 0, "errors": 0}
+    start = time.perf_counter()
+    deadline = start + seconds
+    await asyncio.gather(*(play(host, port, index, deadline, latencies, counts, seed + index)
+                           for index in range(sessions)))
+    elapsed = time.perf_counter() - start
+    ordered = sorted(latencies)
+    print(f"{sessions} sessions, {counts['moves']} moves, {counts['games']} games, {counts['errors']} errors "
+          f"in {elapsed:.1f}s: {counts['moves'] / elapsed:,.0f} moves/s")
+    print("latency " + " ".join(f"p{p}={percentile(ordered, p) * 1000:.1f}ms" for p in (50, 90, 99))
+          + f" max={(ordered[-1] if ordered else 0.0) * 1000:.1f}ms")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play random games against server.py from many sessions at once")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn", action="store_true", help="start a server.py on a free local port first")
+    parser.add_argument("--idle-timeout", type=float, help="check that idle sessions are evicted after this many "
+                                                           "seconds, passed on to a spawned server")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        args.port = free_port()
+        command = [sys.executable, "server.py", "--host", args.host, "--port", str(args.port)]
+        if args.idle_timeout is not None:
+            command += ["--idle-timeout", str(args.idle_timeout)]
+        server = subprocess.Popen(command, stdout=subprocess.PIPE, cwd=sys.path[0] or None)
+        server.stdout.readline()                # wait for "serving Kuba on ..."
+    try:
+        asyncio.run(run(args.host, args.port, args.sessions, args.seconds, args.seed))
+        if args.idle_timeout is not None and not asyncio.run(check_eviction(args.host, args.port, args.idle_timeout,
+                                                                            args.seed)):
+            sys.exit(1)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,23 @@
 # push off all opponent marbles or captures 7 red marbles will win the game. The player can only move their own color
 # marble, cant push off their own marble, and can not undo a move. If there is no room to move the marble, then player
 # cant move that marble. Any player can start the game first.
+#
+# The rules engine (KubaGame's board, validation, pushes and win logic) does not need pygame, so pygame is only
+# imported by init_display() when the game is launched as a script. Importing this module stays headless.
 
-import pygame
+import argparse
+import collections
+import contextlib
+import time
+
+from search import AlphaBetaSearch
+from state import BAD_DIRECTION, DIRECTIONS, EMPTY_TILE, GAME_OVER, KO, NO_ROOM, OFF_BOARD, OK, OPPONENT_MARBLE, \
+    OWN_MARBLE, PLAYERS, RED_MARBLE, GameState, board_rays, reds_to_win, starting_board
+from zobrist import piece_keys, position_key
+
+pygame = None   # set by init_display()
+font = None
+WIN = None
 
 WIDTH, HEIGHT = 600, 600
 ROWS, COLS = 7, 7
@@ -17,8 +32,57 @@ BLACK = (0, 0, 0)
 BLUE = (0, 0, 255)
 GRAY = (211, 211, 211)
 
+RAYS, BEHIND = board_rays(ROWS)   # the standard board's rays, see state.build_rays
+
+# make_move results (OK or the reason a move was rejected) are defined in state.py, shared with GameState.apply
+
+# events KubaGame sends to its listeners, see KubaGame.subscribe
+MOVE_APPLIED = "move_applied"       # player, coords, direction, cells (the tiles the push changed), ejected
+MOVE_REJECTED = "move_rejected"     # player, coords, direction, reason (one of the make_move results)
+CAPTURE = "capture"                 # player, points
+TURN_CHANGED = "turn_changed"       # player (now to move)
+GAME_WON = "game_won"               # player, reason ("marbles", "reds" or "blocked"), loser, reds (to win)
+SELECTED = "selected"               # player, coords (see select)
+
+REJECT_MESSAGES = {
+    GAME_OVER: "Stop playing!! {winner} has already won the game!!!",
+    OFF_BOARD: "invalid numbers",
+    OPPONENT_MARBLE: "Cant move opponent marble",
+    RED_MARBLE: "Cant move red marble",
+    EMPTY_TILE: "Cant move empty tile",
+    BAD_DIRECTION: "invalid direction",
+    NO_ROOM: "False move, no room to move marble \n",
+    OWN_MARBLE: "False move, cant push off own marble \n",
+    KO: "False move, cant undo the opponent's last move \n",
+}
+WIN_MESSAGES = {
+    "marbles": "{player} has won the game by pushing off all opponent marbles!!",
+    "reds": "{player} has won the game by capturing {reds} reds!!",
+    "blocked": "{player} has won the game, {loser} has no legal moves left!!",
+}
+
+
+def print_event(event, data):
+    """Listener that prints events the way the game always reported them on the console"""
+    if event == MOVE_REJECTED:
+        print(REJECT_MESSAGES[data["reason"]].format(**data))
+    elif event == CAPTURE:
+        print(f"A red marble has been captured by {data['player']}")
+    elif event == MOVE_APPLIED:
+        print(f"valid move done by {data['player']} \n")
+    elif event == TURN_CHANGED:
+        print(f"It's {data['player']}'s Turn")
+    elif event == GAME_WON:
+        print(WIN_MESSAGES[data["reason"]].format(**data))
+    elif event == SELECTED:
+        print(f"Selected correctly {data['coords']}")
+
+
 class Piece:
-    PADDING = 15
+    """A marble in the scene. Pushes move the existing Piece objects along the line with move, see
+    KubaGame.move_pieces, so they are only created when a board is built"""
+    __slots__ = ("row", "col", "color", "player", "x", "y")
+    PADDING = 18    # percent of SQUARE_SIZE left between the marble and the square's edge, 15 pixels at size 7
     OUTLINE = 2
 
     def __init__(self, row, col, color, player=None):
@@ -35,11 +99,28 @@ class Piece:
         self.x = SQUARE_SIZE * self.col + SQUARE_SIZE // 2
         self.y = SQUARE_SIZE * self.row + SQUARE_SIZE // 2
 
+    @classmethod
+    def radius(cls):
+        """Return the marble radius for the current SQUARE_SIZE, so marbles fill the same share of a square on every
+        board size"""
+        return SQUARE_SIZE//2 - SQUARE_SIZE * cls.PADDING // 100
+
     def draw(self, win):
-        radius = SQUARE_SIZE//2 - self.PADDING
+        radius = self.radius()
         pygame.draw.circle(win, BLACK, (self.x, self.y), radius + self.OUTLINE)  # draw bigger circle
         pygame.draw.circle(win, self.color, (self.x, self.y), radius)  # draw smaller circle
 
+    @classmethod
+    def render_sprite(cls, color):
+        """Return a SQUARE_SIZE surface with a marble of color drawn the same way as draw, to blit instead of
+        drawing circles every frame"""
+        sprite = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE), pygame.SRCALPHA)
+        radius = cls.radius()
+        center = (SQUARE_SIZE // 2, SQUARE_SIZE // 2)
+        pygame.draw.circle(sprite, BLACK, center, radius + cls.OUTLINE)
+        pygame.draw.circle(sprite, color, center, radius)
+        return sprite
+
     def move(self, row, col):
         self.row = row
         self.col = col
@@ -57,22 +138,18 @@ class Piece:
 class KubaGame:
     """KubaGame class that initializes with a board and players. Methods to get turn,winner,marbles and make a move on a
     marble"""
-    def __init__(self):
-        """initializes with a 7x7 board, 8 white/black marbles, 13 red marbles. Unpacks two tuples as player,color.
-        Set turn and winner to None, and set both points = 0"""
+    def __init__(self, quiet=False, size=ROWS):
+        """initializes with a 7x7 board, 8 white/black marbles, 13 red marbles, or the starting_board of another odd
+        size from 5 to 17, where capturing more than half the reds wins. Unpacks two tuples as player,color.
+        Set turn and winner to None, and set both points = 0. Events are printed with print_event unless quiet"""
         # player 1 is white
         # player 2 is black
         self.player1, self.colorA = ('Player1', 'W')
         self.player2, self.colorB = ('Player2', 'B')
-        self.board = [
-            ["[W]", "[W]", "[ ]", "[ ]", "[ ]", "[B]", "[B]"],
-            ["[W]", "[W]", "[ ]", "[R]", "[ ]", "[B]", "[B]"],
-            ["[ ]", "[ ]", "[R]", "[R]", "[R]", "[ ]", "[ ]"],
-            ["[ ]", "[R]", "[R]", "[R]", "[R]", "[R]", "[ ]"],
-            ["[ ]", "[ ]", "[R]", "[R]", "[R]", "[ ]", "[ ]"],
-            ["[B]", "[B]", "[ ]", "[R]", "[ ]", "[W]", "[W]"],
-            ["[B]", "[B]", "[ ]", "[ ]", "[ ]", "[W]", "[W]"],
-        ]
+        self.size = size
+        self.board = starting_board(size)
+        self.rays, self.behind = board_rays(size)
+        self.piece_keys = piece_keys(size)
         self.other_board = []
         self.create_board()
         self.current_turn = self.player1
@@ -80,18 +157,51 @@ class KubaGame:
         self.player2_points = 0
         self.winner = None
         self.selected_piece = None
+        self.changed_cells = set()  # (row, column) of every tile make_move changed since the renderer last drew
+        self.undo_stack = []    # one entry per push_move, see push_move/pop_move
+        self.zobrist = self.compute_hash()
+        self.ko_hash = None     # board hash the next move can not recreate, see ko_after_push
+        self.marble_counts = {"[W]": 0, "[B]": 0, "[R]": 0}
+        self.marble_cells = {"[W]": set(), "[B]": set()}   # where each player's marbles are, kept up by track_push
+        self.count_marbles()
+        self.win_reds = reds_to_win(size)     # 7 of the 13 reds on the standard board
+        self.listeners = []     # callbacks given (event, data) by emit
+        if not quiet:
+            self.subscribe(print_event)
         return
 
+    def subscribe(self, listener):
+        """Call listener(event, data) for every event the game emits, data being a dict of the event's fields (see
+        MOVE_APPLIED and the other event names). Returns listener so it can be passed to unsubscribe"""
+        self.listeners = self.listeners + [listener]    # a new list, so listeners can (un)subscribe during emit
+        return listener
+
+    def unsubscribe(self, listener):
+        """Stop sending events to listener"""
+        self.listeners = [other for other in self.listeners if other is not listener]
+
+    def emit(self, event, **data):
+        """Send event to every listener"""
+        for listener in self.listeners:
+            listener(event, data)
+
+    def reject(self, player, coords, direction, reason):
+        """Emit MOVE_REJECTED and return reason, for make_move"""
+        if self.listeners:
+            self.emit(MOVE_REJECTED, player=player, coords=coords, direction=direction, reason=reason,
+                      winner=self.winner)
+        return reason
+
     def set_turn(self, player):
         """Method to set turn based on the player making the move"""
         if player is self.player1:              # if player1, then its player2 turn
             self.current_turn = self.player2
-            print("It's Player2's Turn")
-            return
-        if player is self.player2:
+        elif player is self.player2:
             self.current_turn = self.player1    # if player2, then its player1 turn
-            print("It's Player1's Turn")
+        else:
             return
+        if self.listeners:
+            self.emit(TURN_CHANGED, player=self.current_turn)
 
     def get_current_turn(self):
         """Returns current turn"""
@@ -114,6 +224,88 @@ class KubaGame:
         else:
             return "invalid player"
 
+    def compute_hash(self):
+        """Return the Zobrist hash of the board by xoring the key of every marble. Moves update self.zobrist
+        incrementally, this full scan is only needed for a new board"""
+        board_hash = 0
+        size = self.size
+        for row in range(size):
+            for column in range(size):
+                tile = self.board[row][column]
+                if tile != "[ ]":
+                    board_hash ^= self.piece_keys[row * size + column][tile[1]]
+        return board_hash
+
+    def push_hash(self, ray, end):
+        """Return the board hash after a push that shifts ray[:end + 1] one cell along the ray (see push_line)"""
+        board_hash = self.zobrist
+        keys, size = self.piece_keys, self.size
+        previous = "[ ]"
+        for index in range(end + 1):            # every cell loses its marble and gains the one behind it
+            row, column = ray[index]
+            tile = self.board[row][column]
+            if tile != "[ ]":
+                board_hash ^= keys[row * size + column][tile[1]]
+            if previous != "[ ]":
+                board_hash ^= keys[row * size + column][previous[1]]
+            previous = tile
+        return board_hash
+
+    def ko_after_push(self, ray, end, pushes_off, player):
+        """Called after player's push along ray, before self.zobrist is updated. Returns the board hash from before
+        the push if the opponent could push the line straight back and recreate it, otherwise None. Only then can
+        the next move break the ko rule, so is_ko stays a single compare"""
+        if pushes_off:                          # a marble that fell off can not come back
+            return None
+        row, column = ray[end]                  # the marble that moved into the empty tile
+        if self.board[row][column] != self.own_marble(self.player2 if player is self.player1 else self.player1):
+            return None
+        if end + 1 < len(ray):
+            row, column = ray[end + 1]
+            if self.board[row][column] != "[ ]":    # no room to push it back
+                return None
+        return self.zobrist
+
+    def is_ko(self, board_hash):
+        """Return True if a move giving board_hash would recreate the board from before the opponent's last move"""
+        return board_hash == self.ko_hash
+
+    def position_key(self):
+        """Return the transposition table key of the current position: board, side to move, captures and ko"""
+        return position_key(self.zobrist, self.current_turn is self.player2, self.player1_points,
+                            self.player2_points, self.ko_hash or 0)
+
+    def get_state(self):
+        """Return the rules state of the game (board, points, turn, winner and ko) as an immutable GameState"""
+        return GameState.from_board(self.board, self.player1_points, self.player2_points,
+                                    0 if self.current_turn is self.player1 else 1,
+                                    None if self.winner is None else PLAYERS.index(self.winner), self.ko_hash or 0)
+
+    def set_state(self, state):
+        """Replace the position with a GameState of the same board size. The undo stack and selection are cleared
+        and the scene is rebuilt"""
+        if state.size != self.size:
+            raise ValueError(f"a {state.size}x{state.size} state does not fit a {self.size}x{self.size} game")
+        self.board = state.board()
+        players = (self.player1, self.player2)
+        self.player1_points, self.player2_points = state.player1_points, state.player2_points
+        self.current_turn = players[state.turn]
+        self.winner = None if state.winner is None else players[state.winner]
+        self.zobrist = state.zobrist
+        self.ko_hash = state.ko_hash or None
+        self.undo_stack = []
+        self.selected_piece = None
+        self.count_marbles()
+        self.update_board()
+        self.changed_cells.update((row, column) for row in range(self.size) for column in range(self.size))
+
+    @classmethod
+    def from_state(cls, state, quiet=False):
+        """Return a KubaGame playing on from a GameState"""
+        game = cls(quiet, state.size)
+        game.set_state(state)
+        return game
+
     def print_board(self):
         """Method to test board for testing purposes"""
         for row in self.board:
@@ -124,7 +316,7 @@ class KubaGame:
     def get_marble(self, coords):
         """Method to return the whatever marble is in coords."""
         row, column = coords
-        if not 0 <= row <= 6 or not 0 <= column <= 6:   # if value in row or column is not valid
+        if not 0 <= row < self.size or not 0 <= column < self.size:     # if value in row or column is not valid
             return
         if self.board[row][column] == "[ ]":            # if the tile is empty
             return "X"
@@ -137,303 +329,319 @@ class KubaGame:
 
     def get_marble_count(self):
         """Method to get total marble count and returns a tuple of those counts"""
-        W = 0
-        B = 0
-        R = 0
-        for row in self.board:
-            for tile in row:
-                if tile == "[W]":
-                    W += 1
-                elif tile == "[B]":
-                    B += 1
-                elif tile == "[R]":
-                    R += 1
-        counts = (W, B, R)
-        return counts
+        return self.marble_counts["[W]"], self.marble_counts["[B]"], self.marble_counts["[R]"]
+
+    def count_marbles(self):
+        """Fill marble_counts and marble_cells from a full scan of board. Moves keep them up to date through
+        track_push, so this is only needed for a new board"""
+        for tile in self.marble_counts:
+            self.marble_counts[tile] = 0
+        for cells in self.marble_cells.values():
+            cells.clear()
+        for row in range(self.size):
+            for column in range(self.size):
+                tile = self.board[row][column]
+                if tile != "[ ]":
+                    self.marble_counts[tile] += 1
+                    if tile in self.marble_cells:
+                        self.marble_cells[tile].add((row, column))
+
+    def track_push(self, ray, end, ejected):
+        """Update marble_counts and marble_cells after shift_line moved ray[:end + 1] and pushed off ejected"""
+        if ejected != "[ ]":
+            self.marble_counts[ejected] -= 1
+            if ejected in self.marble_cells:
+                self.marble_cells[ejected].discard(ray[end])
+        for index in range(end, 0, -1):         # from the far end so a cell is freed before it is taken
+            row, column = ray[index]
+            tile = self.board[row][column]
+            if tile in self.marble_cells:
+                self.marble_cells[tile].discard(ray[index - 1])
+                self.marble_cells[tile].add(ray[index])
+
+    def untrack_push(self, ray, end, ejected):
+        """Undo track_push, called before unshift_line puts the marbles back"""
+        for index in range(1, end + 1):
+            row, column = ray[index]
+            tile = self.board[row][column]
+            if tile in self.marble_cells:
+                self.marble_cells[tile].discard(ray[index])
+                self.marble_cells[tile].add(ray[index - 1])
+        if ejected != "[ ]":
+            self.marble_counts[ejected] += 1
+            if ejected in self.marble_cells:
+                self.marble_cells[ejected].add(ray[end])
+
+    def has_won(self, player):
+        """Return "marbles" if player pushed off all opposing marbles, "reds" if they captured win_reds red marbles,
+        "blocked" if it is the opponent's turn and they have no legal moves, otherwise None. Uses the running marble
+        counts, so it does not scan the board, print or set the winner"""
+        opponent = self.player2 if player is self.player1 else self.player1
+        if self.marble_counts[self.own_marble(opponent)] == 0:
+            return "marbles"
+        if self.get_captured(player) == self.win_reds:
+            return "reds"
+        if self.current_turn is opponent and not self.has_legal_move(opponent):
+            return "blocked"
+        return None
 
     def check_winner(self, player):
-        """Method to check for winner whether no opposing marbles left or player captured 7 red marbles"""
-        # check if game ends by pushing all opposing marbles off
-        # (W, B, R)
-        if player is self.player1:  # if player1 and no more black marbles, player1 win
-            if self.get_marble_count()[1] == 0:
-                print(f"{player} has won the game by pushing off all opponent marbles!!")
-                self.set_winner(player)
-                return
-        if player is self.player2:  # if player2 and no more white marbles, player2 win
-            if self.get_marble_count()[0] == 0:
-                print(f"{player} has won the game by pushing off all opponent marbles!!")
-                self.set_winner(player)
-                return
-        # check if game ends by capturing 7 red marbles
-        if self.get_captured(player) == 7:
-            print(f"{player} has won the game by capturing 7 reds!!")
+        """Method to check for winner whether no opposing marbles left, player captured win_reds red marbles or the
+        opponent has no legal moves left"""
+        reason = self.has_won(player)
+        if reason is not None:
             self.set_winner(player)
-            return
+            if self.listeners:
+                self.announce_win(player, reason)
+
+    def announce_win(self, player, reason):
+        """Emit GAME_WON for player winning by reason"""
+        self.emit(GAME_WON, player=player, reason=reason,
+                  loser=self.player2 if player is self.player1 else self.player1, reds=self.win_reds)
 
     def validate_move(self, player, row, column, direction):
+        """Return the reason player cant move the marble at row, column, or None if they can"""
         if self.get_winner() is not None:               # if game already decided
-            print(f"Stop playing!! {self.get_winner()} has already won the game!!!")
-            return False
-        if not 0 <= row <= 6 or not 0 <= column <= 6:   # if value in row or column is not valid
-            print("invalid numbers")
-            return False
-        if not self.validate_player(player, row, column):
-            return False
-        return True
+            return GAME_OVER
+        if not 0 <= row < self.size or not 0 <= column < self.size:     # if value in row or column is not valid
+            return OFF_BOARD
+        return self.validate_player(player, row, column)
 
     def validate_player(self, player, row, column):
+        """Return the reason the marble at row, column is not player's to move, or None if it is"""
         if self.board[row][column] == "[W]":            # if marble is not the players marble
             if player is self.player2:
-                print("Cant move opponent marble")
-                return False
+                return OPPONENT_MARBLE
         if self.board[row][column] == "[B]":            # if marble is not the players marble
             if player is self.player1:
-                print("Cant move opponent marble")
-                return False
+                return OPPONENT_MARBLE
         if self.board[row][column] == "[R]":            # if trying to move a red marble
-            print("Cant move red marble")
-            return False
+            return RED_MARBLE
         if self.board[row][column] == "[ ]":  # if player wants to move a tile at location but it empty
-            print("Cant move empty tile")
-            return False
-        return True
-
-    def move_right(self, player, row, column, direction):
-        if self.board[row][column - 1] in ("[W]", "[B]", "[R]") and column != 0:  # if there is a marble to the left
-            print("False move, no room to move marble")  # unless its the edge marble
-            return False
-        pos = 1
-        pos2 = 0
-        for tile in self.board[row][column:]:  # row but only starting FROM the tile in play
-            if pos2 == len(self.board[row][column:]) - 1:  # if no empty tiles left to push, push off a marble
-                if self.board[row][-1] == "[W]" and player is self.player1:  # if last marble is the players marble
-                    print("False Move, cant push off own marble")
-                    print("")
-                    return False
-                if self.board[row][-1] == "[B]" and player is self.player2:  # if last marble is the players marble
-                    print("False Move, cant push off own marble")
-                    print("")
-                    return False
-                temp_row = self.board[row][column:]  # make a temp row to shift values
-                temp_row.insert(0, temp_row.pop())  # shift values right
-                if temp_row[0] == "[R]":  # if marble pushed off is red
-                    if player is self.player1:
-                        self.player1_points += 1
-                    if player is self.player2:
-                        self.player2_points += 1
-                    print(f"A red marble has been captured by {player}")
-                temp_row[0] = "[ ]"  # delete marble that was pushed
-                self.board[row][column:] = temp_row  # place back into the row the new values
-
-                self.update_board()
-
-                print(f"valid move done by {player}")
-                print("")
-                self.set_turn(player)  # if player1, then its player2. If player2, then its player1
-                self.check_winner(player)  # checks whether move made by player made them win or not
-                return True  # if so, set winner to player
-            if tile == "[ ]":  # count how many pos it takes til empty tile
-                break
-            pos += 1
-            pos2 += 1
-        temp_row = self.board[row][column:column + pos]  # make a temp row to shift values
-        temp_row.insert(0, temp_row.pop())  # shift values right
-        self.board[row][column:column + pos] = temp_row  # place new shifted values back into row
-
-        self.update_board()
+            return EMPTY_TILE
+        return None
+
+    def shift_line(self, ray, end):
+        """Move the marbles on ray[:end] one cell along the ray in place, leaving the pushed marble's cell empty.
+        Returns the tile that was on ray[end]: "[ ]" when the line moved into a gap, otherwise the marble that was
+        pushed off the board. This is the one push used for every direction"""
+        board = self.board
+        row, column = ray[end]
+        ejected = board[row][column]
+        for index in range(end, 0, -1):
+            row, column = ray[index]
+            behind_row, behind_column = ray[index - 1]
+            board[row][column] = board[behind_row][behind_column]
+        row, column = ray[0]
+        board[row][column] = "[ ]"
+        return ejected
+
+    def unshift_line(self, ray, end, ejected):
+        """Undo shift_line, putting ejected back on ray[end]"""
+        board = self.board
+        for index in range(end):
+            row, column = ray[index]
+            ahead_row, ahead_column = ray[index + 1]
+            board[row][column] = board[ahead_row][ahead_column]
+        row, column = ray[end]
+        board[row][column] = ejected
 
-        print(f"valid move done by {player}")
-        print("")
-        self.set_turn(player)
-        return True
+    def make_move(self, player, coords, direction):
+        """make_move method that first checks if move can be validated before pushing the line of marbles in direction
+        taking player, coords, and direction as parameters. Returns OK if successful, otherwise the reason the move
+        cant be made (GAME_OVER, NO_ROOM, KO, ...), and emits the matching events"""
+        row, column = coords
+        reason = self.validate_move(player, row, column, direction)
+        if reason is not None:
+            return self.reject(player, coords, direction, reason)
+        if direction not in DIRECTIONS:
+            return self.reject(player, coords, direction, BAD_DIRECTION)
+        line = self.push_line(row, column, direction)
+        if line is None:                        # a marble behind it, unless its the edge marble
+            return self.reject(player, coords, direction, NO_ROOM)
+        ray, end, pushes_off = line
+        end_row, end_column = ray[end]
+        if pushes_off and self.board[end_row][end_column] == self.own_marble(player):
+            return self.reject(player, coords, direction, OWN_MARBLE)
+        board_hash = self.push_hash(ray, end)
+        if self.is_ko(board_hash):              # a player can not undo the opponent's move
+            return self.reject(player, coords, direction, KO)
+
+        ejected = self.shift_line(ray, end)
+        if ejected == "[R]":                    # if marble pushed off is red
+            if player is self.player1:
+                self.player1_points += 1
+            if player is self.player2:
+                self.player2_points += 1
+        self.current_turn = self.player2 if player is self.player1 else self.player1
+        self.ko_hash = self.ko_after_push(ray, end, pushes_off, player)
+        self.zobrist = board_hash
+        self.track_push(ray, end, ejected)
+        self.move_pieces(ray, end)
+        self.changed_cells.update(ray[:end + 1])
+        reason = self.has_won(player)           # checks whether move made by player made them win or not
+        if reason is not None:
+            self.set_winner(player)
 
-    def move_left(self, player, row, column, direction):
-        if column != 6 and self.board[row][column + 1] in ("[W]", "[B]", "[R]"):  # if there is a marble to the right
-            print("False move, no room to move marble")  # unless its the edge marble
+        # events go out only once the move is complete, so a listener can query the game or move in reply
+        if self.listeners:
+            if ejected == "[R]":
+                self.emit(CAPTURE, player=player, points=self.get_captured(player))
+            self.emit(MOVE_APPLIED, player=player, coords=coords, direction=direction, cells=ray[:end + 1],
+                      ejected=None if ejected == "[ ]" else ejected[1])
+            self.emit(TURN_CHANGED, player=self.current_turn)
+            if reason is not None:
+                self.announce_win(player, reason)
+        return OK
+
+    def own_marble(self, player):
+        """Return the board tile of the marbles player is allowed to move, or None for an unknown player"""
+        if player is self.player1:
+            return "[W]"
+        if player is self.player2:
+            return "[B]"
+        return None
+
+    def push_line(self, row, column, direction):
+        """Return (ray, end, pushes_off) for pushing the marble at row, column in direction, or None if there is no
+        room to move it. ray is the precomputed rays line from the marble to the edge and ray[:end + 1] the cells the
+        push writes to: the marbles that move and then the empty tile they move into, or up to the marble that falls
+        off when pushes_off is True"""
+        behind = self.behind[direction][row][column]
+        if behind is not None and self.board[behind[0]][behind[1]] != "[ ]":
+            return None
+        ray = self.rays[direction][row][column]
+        board = self.board
+        for end in range(1, len(ray)):
+            cell_row, cell_column = ray[end]
+            if board[cell_row][cell_column] == "[ ]":
+                return ray, end, False
+        return ray, len(ray) - 1, True
+
+    def ejects(self, coords, direction):
+        """Return the marble ("W", "B" or "R") a legal move at coords in direction pushes off the board, or None"""
+        if direction not in DIRECTIONS:
+            return None
+        line = self.push_line(coords[0], coords[1], direction)
+        if line is None or not line[2]:
+            return None
+        row, column = line[0][line[1]]
+        return self.board[row][column][1]
+
+    def marble_moves(self, own, row, column):
+        """Generator yielding the legal directions for the own marble at row, column"""
+        for direction in DIRECTIONS:
+            line = self.push_line(row, column, direction)
+            if line is None:                # no room to move marble
+                continue
+            ray, end, pushes_off = line
+            end_row, end_column = ray[end]
+            if pushes_off and self.board[end_row][end_column] == own:  # cant push off own marble
+                continue
+            if self.ko_hash is not None and self.is_ko(self.push_hash(ray, end)):
+                continue
+            yield direction
+
+    def legal_moves(self, player):
+        """Generator yielding every (coords, direction) that make_move would accept for player. Uses the same rules as
+        validate_player, the no room to move and cant push off own marble checks in push_line and make_move"""
+        if self.get_winner() is not None:
+            return
+        own = self.own_marble(player)
+        if own is None:
+            return
+        for row, column in sorted(self.marble_cells[own]):
+            for direction in self.marble_moves(own, row, column):
+                yield (row, column), direction
+
+    def has_legal_move(self, player):
+        """Return True if player has at least one legal move, stopping at the first one found"""
+        own = self.own_marble(player)
+        return any(True for row, column in self.marble_cells[own] for _ in self.marble_moves(own, row, column))
+
+    def push_move(self, player, coords, direction):
+        """Make a move for search and analysis without printing. Only board, points, turn and winner change, and the
+        push is undone by shifting the line back, so pop_move only needs the ray and the ejected tile from
+        undo_stack. other_board is not rebuilt. Returns False if the move cant be made and True if successful"""
+        row, column = coords
+        if self.get_winner() is not None or not 0 <= row < self.size or not 0 <= column < self.size:
             return False
-        pos = 1
-        pos2 = 0
-        for tile in self.board[row][column::-1]:  # row but only starting FROM the tile in play
-            if pos2 == len(self.board[row][column::-1]) - 1:  # if not tiles left to push, push off a marble
-                if self.board[row][0] == "[W]" and player is self.player1:  # if last marble is the player's marble
-                    print("False Move, cant push off own marble \n")
-                    return False
-                if self.board[row][0] == "[B]" and player is self.player2:  # if last marble is the player's marble
-                    print("False Move, cant push off own marble \n")
-                    return False
-                temp_row = self.board[row][column::-1]  # make a temp row to shift values
-                temp_row.insert(0, temp_row.pop())  # shift values right
-                if temp_row[0] == "[R]":  # if marble pushed off is red
-                    if player is self.player1:  # if marble pushed off is red
-                        self.player1_points += 1
-                    if player is self.player2:
-                        self.player2_points += 1
-                    print(f"A red marble has been captured by {player}")
-                temp_row[0] = "[ ]"  # delete last marble that was pushed
-                self.board[row][column::-1] = temp_row  # while reading backwards place new values in row
-
-                self.update_board()
-
-                print(f"valid move done by {player} \n")
-                self.set_turn(player)  # if player1, then its player2. If player2, then its player1
-                self.check_winner(player)  # checks whether move made by player made them win or not
-                return True  # if so, set winner to player
-            if tile == "[ ]":  # count how many pos it takes til empty tile
-                break
-            pos += 1
-            pos2 += 1
-        temp_row = self.board[row][column:column - pos:-1]  # make a temp row to shift values
-        temp_row.insert(0, temp_row.pop())  # shift values right
-        self.board[row][column:column - pos:-1] = temp_row  # while reading backwards, place new values in row
-
-        self.update_board()
-
-        print(f"valid move done by {player} \n")
-        self.set_turn(player)
-        return True
-
-    def move_forward(self, player, row, column, direction):
-        if row != 6 and self.board[row + 1][column] in ("[W]", "[B]", "[R]"):  # if there is a marble one row in front
-            print("False move, no room to move marble \n")  # unless its the edge marble
+        if direction not in DIRECTIONS:
             return False
-        pos = 1
-        pos2 = 0
-        for rows in self.board[row::-1]:  # count how many rows it takes to reach an empty tile
-            if pos == len(self.board[row::-1]):  # if no empty tiles left to push, push off marble
-                if self.board[row - pos2::-1][0][column] == "[W]" and player is self.player1:
-                    print("False move, cant push off own marble \n")  # if last marble is the players marble
-                    return False
-                if self.board[row - pos2::-1][0][column] == "[B]" and player is self.player2:
-                    print("False move, cant push off own marble \n")  # if last marble is the players marble
-                    return False
-                while pos2 != 0:
-                    # whichever tile is on the last row, switch that tile with the tile behind it until it reaches
-                    # the initial row that the player chose
-                    self.board[row - pos2::-1][0].insert(column, self.board[row - pos2 + 1::-1][0].pop(column))
-                    self.board[row - pos2 + 1::-1][0].insert(column, self.board[row - pos2::-1][0].pop(column + 1))
-                    pos2 -= 1
-                if self.board[row - pos2::-1][0][column] == "[R]":  # if last marble being pushed off is red
-                    if player is self.player1:
-                        self.player1_points += 1
-                    if player is self.player2:
-                        self.player2_points += 1
-                    print(f"A red marble has been captured by {player}")
-                self.board[row - pos2::-1][0][column] = "[ ]"  # delete last marble that was pushed
-
-                self.update_board()
-
-                print(f"valid move done by {player} \n")
-                self.set_turn(player)  # if player1, then its player2. If player2, then its player1
-                self.check_winner(player)  # checks whether move made by player made them win or not
-                return True  # if so, set winner to player
-            if rows[column] == "[ ]":
-                break
-            pos += 1
-            pos2 += 1
-        while pos2 != 0:
-            # while reading backwards, insert into the row that contains the empty tile, the tile in the row behind it
-            # (technically the row in front, but we reading backwards) then insert in the row we just popped a val from,
-            # the empty tile that we are switching.
-            # Repeat until the empty tile reaches the initial row that the player chose
-            self.board[row::-1][pos2].insert(column, self.board[row::-1][pos2 - 1].pop(column))
-            self.board[row::-1][pos2 - 1].insert(column, self.board[row::-1][pos2].pop(column + 1))
-            pos2 -= 1
-
-        self.update_board()
-
-        print(f"valid move done by {player} \n")
-        self.set_turn(player)
-        return True
-
-    def move_back(self, player, row, column, direction):
-        if row != 0 and self.board[row - 1][column] in ("[W]", "[B]", "[R]"):  # if there is a marble one row behind
-            print("False move, no room to move marble \n")  # unless its a edge marble
+        own = self.own_marble(player)
+        if own is None or self.board[row][column] != own:
             return False
-        pos = 1
-        pos2 = 0
-        for rows in self.board[row::]:  # count how many rows it takes to reach an empty tile
-            if pos == len(self.board[row::]):  # if no empty tile left to push, push off marble
-                if self.board[row + pos2::][0][column] == "[W]" and player is self.player1:
-                    print("False move, cant push off own marble \n")  # if last marble is the players marble
-                    return False
-                if self.board[row + pos2::][0][column] == "[B]" and player is self.player2:
-                    print("False move, cant push off own marble \n")  # if last marble is the players marble
-                    return False
-                while pos2 != 0:
-                    # whichever tile is in the last row, switch that tile with the tile behind it until it reaches
-                    # the initial row that the player chose
-                    self.board[row::][pos2].insert(column, self.board[row::][pos2 - 1].pop(column))
-                    self.board[row::][pos2 - 1].insert(column, self.board[row::][pos2].pop(column + 1))
-                    pos2 -= 1
-                if self.board[row::][0][column] == "[R]":  # if last marble being pushed off is red
-                    if player is self.player1:
-                        self.player1_points += 1
-                    if player is self.player2:
-                        self.player2_points += 1
-                    print(f"A red marble has been captures by {player}")
-                self.board[row::][0][column] = "[ ]"  # delete the marble being pushed off
-
-                self.update_board()
-
-                print(f"valid move done by {player} \n")
-                self.set_turn(player)  # if player1, then its player2. If player2, then its player1
-                self.check_winner(player)  # checks whether move made by player made them win or not
-                return True  # if so, set winner to player
-            if rows[column] == "[ ]":
-                break
-            pos += 1
-            pos2 += 1
-        while pos2 != 0:
-            # starting with the empty tile in the first row iterated that contained an empty tile, switch
-            # that empty tile with the tile, one row behind it. Repeat until the empty tile reaches the initial
-            # row the player chose
-            self.board[row::][pos2].insert(column, self.board[row::][pos2 - 1].pop(column))
-            self.board[row::][pos2 - 1].insert(column, self.board[row::][pos2].pop(column + 1))
-            pos2 -= 1
-
-        self.update_board()
-
-        print(f"valid move done by {player} \n")
-        self.set_turn(player)
-        return True
-
-    def make_move(self, player, coords, direction):
-        """make_move method that first checks if move can be validated before checking which direction to go taking
-        player, coords, and direction as parameters, returning False if the move cant be made and True if successful"""
-        row, column = coords
-        if not self.validate_move(player, row, column, direction):
+        line = self.push_line(row, column, direction)
+        if line is None:
+            return False
+        ray, end, pushes_off = line
+        end_row, end_column = ray[end]
+        if pushes_off and self.board[end_row][end_column] == own:
+            return False
+        board_hash = self.push_hash(ray, end)
+        if self.is_ko(board_hash):
             return False
 
-        if direction == "R":      # go right
-            if not self.move_right(player, row, column, direction):
-                return False
-
-        if direction == "L":      # go left
-            if not self.move_left(player, row, column, direction):
-                return False
-
-        if direction == "F":
-            if not self.move_forward(player, row, column, direction):
-                return False
+        state = (self.player1_points, self.player2_points, self.current_turn, self.winner, self.zobrist, self.ko_hash)
+        ejected = self.shift_line(ray, end)
+        self.undo_stack.append((ray, end, ejected, state))
+        if ejected == "[R]":
+            if player is self.player1:
+                self.player1_points += 1
+            else:
+                self.player2_points += 1
+        self.current_turn = self.player2 if player is self.player1 else self.player1
+        self.ko_hash = self.ko_after_push(ray, end, pushes_off, player)
+        self.zobrist = board_hash
+        self.track_push(ray, end, ejected)
+        if self.has_won(player):
+            self.winner = player
+        return True
 
-        if direction == "B":
-            if not self.move_back(player, row, column, direction):
-                return False
-        return
+    def pop_move(self):
+        """Undo the last push_move"""
+        ray, end, ejected, state = self.undo_stack.pop()
+        self.player1_points, self.player2_points, self.current_turn, self.winner, self.zobrist, self.ko_hash = state
+        self.untrack_push(ray, end, ejected)
+        self.unshift_line(ray, end, ejected)
+
+    def perft(self, depth, table=None):
+        """Count the positions reached after exactly depth plies of legal moves from the current position, with the
+        side to move alternating. Used to check other engines against this one. Subtree counts are cached in table
+        (a zobrist.TranspositionTable) when one is given"""
+        if depth == 0:
+            return 1
+        if table is not None:
+            key = self.position_key()
+            entry = table.probe(key)
+            if entry is not None and entry[1] == depth:
+                return entry[2]
+        moves = list(self.legal_moves(self.current_turn))
+        if depth == 1:
+            nodes = len(moves)
+        else:
+            nodes = 0
+            for coords, direction in moves:
+                self.push_move(self.current_turn, coords, direction)
+                nodes += self.perft(depth - 1, table)
+                self.pop_move()
+        if table is not None:
+            table.store(key, depth, nodes)
+        return nodes
 
     def draw_squares(self, win):
         win.fill(GRAY)
 
-        for row in range(0, WIDTH, SQUARE_SIZE):
-            for col in range(0, HEIGHT, SQUARE_SIZE):
-                rect = pygame.Rect(row, col, SQUARE_SIZE, SQUARE_SIZE)
+        for row in range(self.size):
+            for col in range(self.size):
+                rect = pygame.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
                 pygame.draw.rect(win, BLACK, rect, 1)
 
     def create_board(self):
-        for row in range(ROWS):
+        """Fill other_board with a Piece for every marble on board and "[ ]" for empty tiles"""
+        for row in range(self.size):
             self.other_board.append([])
-            for col in range(COLS):
+            for col in range(self.size):
                 if self.board[row][col] == "[W]":
                     self.other_board[row].append(Piece(row, col, WHITE, 'Player1'))
                 elif self.board[row][col] == "[B]":
@@ -444,23 +652,29 @@ class KubaGame:
                     self.other_board[row].append("[ ]")
 
     def update_board(self):
+        """Rebuild other_board from board. Moves keep it in sync through move_pieces, so this is only needed after
+        board is changed some other way"""
         self.other_board = []
-        for row in range(ROWS):
-            self.other_board.append([])
-            for col in range(COLS):
-                if self.board[row][col] == "[W]":
-                    self.other_board[row].append(Piece(row, col, WHITE, 'Player1'))
-                elif self.board[row][col] == "[B]":
-                    self.other_board[row].append(Piece(row, col, BLACK, 'Player2'))
-                elif self.board[row][col] == "[R]":
-                    self.other_board[row].append(Piece(row, col, RED))
-                else:
-                    self.other_board[row].append("[ ]")
+        self.create_board()
+
+    def move_pieces(self, ray, end):
+        """Move the Piece objects the same way shift_line moved the tiles: every piece on ray[:end] steps one cell
+        along the ray, and the one on ray[end] falls off if the push took it off the board"""
+        other_board = self.other_board
+        for index in range(end, 0, -1):
+            row, col = ray[index]
+            behind_row, behind_col = ray[index - 1]
+            piece = other_board[behind_row][behind_col]
+            other_board[row][col] = piece
+            if piece != "[ ]":
+                piece.move(row, col)
+        row, col = ray[0]
+        other_board[row][col] = "[ ]"
 
     def draw(self, win):
         self.draw_squares(win)
-        for row in range(ROWS):
-            for col in range(COLS):
+        for row in range(self.size):
+            for col in range(self.size):
                 piece = self.other_board[row][col]
                 if piece != "[ ]":
                     piece.draw(win)
@@ -473,23 +687,35 @@ class KubaGame:
         return self.other_board[row][col]
 
     def select(self, row, col):
+        """Select the marble at row, col for the side to move, to be pushed by set_direction. Returns True if it was
+        selected, otherwise emits MOVE_REJECTED with the reason and returns False"""
         if self.get_winner() is not None:
-            print(f"Stop playing!! {self.get_winner()} has already won the game!!!")
+            self.reject(self.get_current_turn(), (row, col), None, GAME_OVER)
+            return False
+        if not 0 <= row < self.size or not 0 <= col < self.size:
+            self.reject(self.get_current_turn(), (row, col), None, OFF_BOARD)
             return False
         piece = self.get_piece(row, col)
         if piece != "[ ]" and piece.player == self.current_turn:
             self.selected_piece = (row, col)
-            print(f"Selected correctly {self.selected_piece}")
+            if self.listeners:
+                self.emit(SELECTED, player=self.current_turn, coords=self.selected_piece)
             return True
-        self.validate_player(self.get_current_turn(), row, col)
+        reason = self.validate_player(self.get_current_turn(), row, col)
+        if reason is not None:
+            self.reject(self.get_current_turn(), (row, col), None, reason)
         return False
 
     def set_direction(self, direction):
-        if self.get_winner() is not None:
-            print(f"Stop playing!! {self.get_winner()} has already won the game!!!")
+        """Push the selected marble in direction for the side to move. Returns the make_move result, or None if
+        nothing is selected"""
         if self.selected_piece:
-            self.make_move(self.get_current_turn(), self.selected_piece, direction)
+            result = self.make_move(self.get_current_turn(), self.selected_piece, direction)
             self.selected_piece = None
+            return result
+        if self.get_winner() is not None:
+            self.reject(self.get_current_turn(), None, direction, GAME_OVER)
+        return None
 
     def show_score(self, x, y):
         score1 = font.render("White Score : " + str(self.player1_points), True, BLUE)
@@ -498,6 +724,48 @@ class KubaGame:
         WIN.blit(score2, (x+420, y))
 
 
+class BoardRenderer:
+    """Draws a KubaGame incrementally. The grid and one sprite per marble colour are rendered once, then draw only
+    repaints the tiles in game.changed_cells plus the score band and returns their rects for display.update"""
+    def __init__(self, win, game):
+        self.win = win
+        self.background = pygame.Surface(win.get_size())
+        game.draw_squares(self.background)
+        self.sprites = {color: Piece.render_sprite(color) for color in (WHITE, BLACK, RED)}
+        self.score = None
+        self.full_redraw = True
+
+    def draw_cell(self, game, row, col):
+        """Repaint one tile from the background and blit its marble, returning the tile rect"""
+        rect = pygame.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+        self.win.blit(self.background, rect, rect)
+        piece = game.get_piece(row, col)
+        if piece != "[ ]":
+            self.win.blit(self.sprites[piece.color], rect)
+        return rect
+
+    def draw(self, game):
+        """Repaint whatever changed since the last call and return the dirty rects, empty if nothing did"""
+        if self.full_redraw:
+            self.win.blit(self.background, (0, 0))
+            cells = {(row, col) for row in range(game.size) for col in range(game.size)}
+        else:
+            cells = set(game.changed_cells)
+        game.changed_cells.clear()
+        score = (game.player1_points, game.player2_points)
+        score_changed = score != self.score or any(row == 0 for row, _ in cells)
+        if score_changed:               # the score is drawn over the top row of tiles, so repaint the whole row
+            cells.update((0, col) for col in range(game.size))
+        rects = [self.draw_cell(game, row, col) for row, col in cells]
+        if score_changed:
+            game.show_score(10, 0)
+            self.score = score
+        if self.full_redraw:
+            self.full_redraw = False
+            return [self.win.get_rect()]
+        return rects
+
+
 def get_row_col_from_mouse(pos):
     x, y = pos
     row = y // SQUARE_SIZE
@@ -505,44 +773,147 @@ def get_row_col_from_mouse(pos):
     return row, col
 
 
-pygame.init()
-font = pygame.font.Font(None, 32)
-WIN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Kuba")
-
-
-def main():
+def init_display():
+    """Import pygame and open the game window. Only the renderer needs this, the rules engine never calls it"""
+    global pygame, font, WIN
+    import pygame
+    pygame.init()
+    font = pygame.font.Font(None, 32)
+    WIN = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Kuba")
+
+
+def play_ai_move(game, searcher):
+    """Ask searcher for a move for the side to move and play it through select/set_direction, like a click and a
+    key press would"""
+    result = searcher.search(game)
+    print(f"AI move for {game.get_current_turn()}: {result.move}, depth {result.depth}, {result.nodes} nodes, "
+          f"{result.nps:.0f} nodes/s")
+    if result.move is not None:
+        coords, direction = result.move
+        game.select(*coords)
+        game.set_direction(direction)
+
+
+class FrameStats:
+    """Collects timings in milliseconds per category (frame, events, draw, make_move, ai) over the last window
+    samples and reports percentiles of each"""
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, window=1000):
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+
+    @contextlib.contextmanager
+    def timed(self, category):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[category].append((time.perf_counter() - start) * 1000)
+
+    def percentiles(self, category):
+        """Return {"p50": ms, "p90": ms, "p99": ms, "max": ms} for one category"""
+        ordered = sorted(self.samples[category])
+        if not ordered:
+            return {}
+        result = {f"p{p}": ordered[min(len(ordered) - 1, len(ordered) * p // 100)] for p in self.PERCENTILES}
+        result["max"] = ordered[-1]
+        return result
+
+    def report(self):
+        """Return one line per category with its sample count, percentiles and max"""
+        lines = []
+        for category, samples in self.samples.items():
+            values = " ".join(f"{name}={ms:.2f}ms" for name, ms in self.percentiles(category).items())
+            lines.append(f"{category:<9} n={len(samples):<5} {values}")
+        return "\n".join(lines)
+
+
+def main(ai_players=(), ai_ms=500, stats_every=None, size=ROWS):
+    """Run the game window on a size x size board. Players in ai_players are moved by the alpha-beta search, and
+    pressing space asks it for a move for whichever side is to move. While no computer move is pending the loop
+    blocks on pygame.event.wait and only redraws after something changed, otherwise it runs capped at FPS. With
+    stats_every set, frame, event, draw, make_move and ai timings are logged every stats_every seconds and when the
+    window closes"""
+    global SQUARE_SIZE
+    SQUARE_SIZE = WIDTH // size             # before any Piece is placed
     run = True
     clock = pygame.time.Clock()
-    game = KubaGame()
+    game = KubaGame(size=size)
+    searcher = AlphaBetaSearch(ai_ms)
+    renderer = BoardRenderer(WIN, game)
+    stats = FrameStats()
+    last_report = time.perf_counter()
 
-    while run:
-        clock.tick(FPS)
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                run = False
-
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                pos = pygame.mouse.get_pos()
-                row, col = get_row_col_from_mouse(pos)
-                game.select(row, col)
-
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_RIGHT:
-                    game.set_direction("R")
-                if event.key == pygame.K_LEFT:
-                    game.set_direction("L")
-                if event.key == pygame.K_UP:
-                    game.set_direction("F")
-                if event.key == pygame.K_DOWN:
-                    game.set_direction("B")
-
-        game.draw(WIN)
-        game.show_score(10, 0)
-        pygame.display.update()
+    make_move = game.make_move
 
+    def timed_make_move(player, coords, direction):
+        with stats.timed("make_move"):
+            return make_move(player, coords, direction)
+    game.make_move = timed_make_move        # so moves from clicks and from the AI are both timed
+
+    while run:
+        ai_to_move = game.get_current_turn() in ai_players and game.get_winner() is None
+        if ai_to_move:
+            clock.tick(FPS)
+            events = pygame.event.get()
+        else:                               # idle: sleep until there is input
+            events = [pygame.event.wait()] + pygame.event.get()
+        frame_start = time.perf_counter()
+
+        with stats.timed("events"):
+            for event in events:
+                if event.type == pygame.QUIT:
+                    run = False
+
+                if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    renderer.full_redraw = True
+
+                if event.type == pygame.MOUSEBUTTONDOWN:
+                    pos = pygame.mouse.get_pos()
+                    row, col = get_row_col_from_mouse(pos)
+                    game.select(row, col)
+
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_RIGHT:
+                        game.set_direction("R")
+                    if event.key == pygame.K_LEFT:
+                        game.set_direction("L")
+                    if event.key == pygame.K_UP:
+                        game.set_direction("F")
+                    if event.key == pygame.K_DOWN:
+                        game.set_direction("B")
+                    if event.key == pygame.K_SPACE and game.get_winner() is None:
+                        with stats.timed("ai"):
+                            play_ai_move(game, searcher)
+
+        if ai_to_move:
+            with stats.timed("ai"):
+                play_ai_move(game, searcher)
+
+        with stats.timed("draw"):
+            dirty = renderer.draw(game)
+            if dirty:
+                pygame.display.update(dirty)
+        stats.samples["frame"].append((time.perf_counter() - frame_start) * 1000)
+
+        if stats_every is not None and time.perf_counter() - last_report >= stats_every:
+            print(stats.report())
+            last_report = time.perf_counter()
+
+    if stats_every is not None:
+        print(stats.report())
     pygame.quit()
 
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kuba board game")
+    parser.add_argument("--ai", action="append", default=[], choices=["Player1", "Player2"],
+                        help="let the computer play this side, can be given twice")
+    parser.add_argument("--ai-ms", type=int, default=500, help="time budget per computer move in milliseconds")
+    parser.add_argument("--stats", type=float, metavar="SECONDS",
+                        help="log frame, event, draw, make_move and ai timing percentiles every SECONDS")
+    parser.add_argument("--size", type=int, default=ROWS, help="board size, odd from 5 to 17")
+    args = parser.parse_args()
+    init_display()
+    main(args.ai, args.ai_ms, args.stats, args.size)
@@ -0,0 +1,181 @@
+# Description: Monte Carlo Tree Search player for Kuba. Each search grows a UCT tree from the current position and
+# scores leaves with random playouts, lightly guided towards pushes that eject a marble, played until get_winner
+# is set or the side to move has no legal moves. Root parallelism runs independent trees in a
+# concurrent.futures.ProcessPoolExecutor and merges their root move statistics. Works on any engine with
+# legal_moves, push_move/pop_move and ejects, e.g. KubaGame or BitboardKubaGame.
+#
+#   python mcts.py --workers 8 --playouts 20000
+
+import argparse
+import collections
+import concurrent.futures
+import math
+import random
+import time
+
+from bitboard import BitboardKubaGame
+
+EXPLORATION = 1.4               # UCT exploration constant
+MAX_PLAYOUT_PLIES = 400         # a playout that runs longer than this counts as a draw
+GUIDED_CHANCE = 0.5             # chance a playout move takes an ejecting push when there is one
+
+MCTSResult = collections.namedtuple("MCTSResult", "move visits win_rate playouts seconds playouts_per_second stats")
+
+
+class Node:
+    """One position in the search tree. wins are counted for the player who made the move leading here"""
+    __slots__ = ("move", "parent", "children", "untried", "visits", "wins", "player")
+
+    def __init__(self, move, parent, player, untried):
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.wins = 0.0
+        self.player = player
+
+    def select_child(self):
+        """Return the child with the highest UCT score"""
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda child: child.wins / child.visits
+                   + EXPLORATION * math.sqrt(log_visits / child.visits))
+
+
+def other_player(game, player):
+    """Return the opponent of player"""
+    return game.player2 if player == game.player1 else game.player1
+
+
+def playout(game, rng, guided=True):
+    """Play random moves until the game is decided, undo them and return the winner, or None for a draw"""
+    plies = 0
+    winner = None
+    while plies < MAX_PLAYOUT_PLIES:
+        winner = game.get_winner()
+        if winner is not None:
+            break
+        player = game.get_current_turn()
+        moves = list(game.legal_moves(player))
+        if not moves:                       # a player with no legal moves has lost
+            winner = other_player(game, player)
+            break
+        move = None
+        if guided and rng.random() < GUIDED_CHANCE:
+            ejecting = [candidate for candidate in moves if game.ejects(*candidate) is not None]
+            if ejecting:
+                move = rng.choice(ejecting)
+        if move is None:
+            move = rng.choice(moves)
+        game.push_move(player, *move)
+        plies += 1
+    for _ in range(plies):
+        game.pop_move()
+    return winner
+
+
+def run_mcts(game, playouts, seed=None, guided=True):
+    """Grow one tree from game with playouts iterations and return {move: (visits, wins)} for the root moves, wins
+    counted for the side to move at the root. game is left as it was"""
+    rng = random.Random(seed)
+    root_player = game.get_current_turn()
+    root = Node(None, None, other_player(game, root_player), list(game.legal_moves(root_player)))
+    for _ in range(playouts):
+        node = root
+        depth = 0
+        while not node.untried and node.children:           # selection
+            node = node.select_child()
+            game.push_move(game.get_current_turn(), *node.move)
+            depth += 1
+        if node.untried and game.get_winner() is None:      # expansion
+            move = node.untried.pop(rng.randrange(len(node.untried)))
+            player = game.get_current_turn()
+            game.push_move(player, *move)
+            depth += 1
+            child = Node(move, node, player, list(game.legal_moves(game.get_current_turn())))
+            node.children.append(child)
+            node = child
+        winner = playout(game, rng, guided)                  # simulation
+        while node is not None:                             # backpropagation
+            node.visits += 1
+            if winner is None:
+                node.wins += 0.5
+            elif winner == node.player:
+                node.wins += 1
+            node = node.parent
+        for _ in range(depth):
+            game.pop_move()
+    return {child.move: (child.visits, child.wins) for child in root.children}
+
+
+def merge_stats(results):
+    """Sum the {move: (visits, wins)} dicts from several trees"""
+    merged = {}
+    for stats in results:
+        for move, (visits, wins) in stats.items():
+            total_visits, total_wins = merged.get(move, (0, 0.0))
+            merged[move] = (total_visits + visits, total_wins + wins)
+    return merged
+
+
+class MCTSPlayer:
+    """Root parallel MCTS. search(game) splits playouts between workers processes, each growing its own tree, and
+    picks the root move with the most merged visits. Use as a context manager or call close() to stop the pool"""
+    def __init__(self, playouts=10000, workers=1, seed=None, guided=True):
+        self.playouts = playouts
+        self.workers = workers
+        self.seed = seed
+        self.guided = guided
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shut down the worker processes"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def search(self, game):
+        """Return an MCTSResult for the side to move in game"""
+        start = time.perf_counter()
+        rng = random.Random(self.seed)
+        shares = [self.playouts // self.workers + (1 if i < self.playouts % self.workers else 0)
+                  for i in range(self.workers)]
+        seeds = [rng.getrandbits(32) for _ in shares]
+        if self.workers == 1:
+            results = [run_mcts(game, shares[0], seeds[0], self.guided)]
+        else:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+            futures = [self.executor.submit(run_mcts, game, share, seed, self.guided)
+                       for share, seed in zip(shares, seeds)]
+            results = [future.result() for future in futures]
+        stats = merge_stats(results)
+        seconds = time.perf_counter() - start
+        if not stats:
+            return MCTSResult(None, 0, 0.0, self.playouts, seconds, self.playouts / seconds, stats)
+        move, (visits, wins) = max(stats.items(), key=lambda item: item[1][0])
+        return MCTSResult(move, visits, wins / visits, self.playouts, seconds, self.playouts / seconds, stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MCTS playout throughput from the starting position")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--playouts", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    with MCTSPlayer(args.playouts, args.workers, args.seed) as player:
+        player.search(BitboardKubaGame())           # start the worker processes before timing
+        result = player.search(BitboardKubaGame())
+    print(f"best move {result.move} visits {result.visits} win rate {result.win_rate:.3f}")
+    print(f"{result.playouts} playouts with {args.workers} workers in {result.seconds:.2f}s, "
+          f"{result.playouts_per_second:,.0f} playouts/s")
+
+
+if __name__ == "__main__":
+    main()
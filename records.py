@@ -0,0 +1,235 @@
+# Description: Compact binary archive of Kuba games. A file is an 8 byte header (MAGIC, version, flags) followed by
+# one record per game: one byte per move, END, a result byte and, when the file has FLAG_CHECKSUM set, the 64-bit
+# position_key of the final position to check replays against. A move byte is cell * 4 + direction with
+# cell = row * 7 + column and directions in R, L, F, B order, the same numbering batch.encode_move uses. Players
+# are not stored: moves alternate starting with Player1, and a PASS byte marks a move by the same player as the
+# one before it (or Player2 moving first). Games always start from the standard position.
+#
+# RecordWriter streams moves to the file as they are made, attached to a KubaGame through its event listeners, and
+# RecordReader memory-maps an archive and yields GameRecords and replayed positions one at a time, so archives of
+# millions of games are never loaded into memory.
+#
+#   python records.py games.kuba --generate 1000
+#   python records.py games.kuba --verify
+
+import argparse
+import collections
+import mmap
+import random
+import struct
+import time
+
+from main import COLS, GAME_WON, MOVE_APPLIED, OK, ROWS, KubaGame
+
+MAGIC = b"KUBA"
+VERSION = 1
+FLAG_CHECKSUM = 1
+HEADER = struct.Struct("<4sBBxx")           # magic, version, flags
+CHECKSUM = struct.Struct("<Q")
+DIRECTION_ORDER = "RLFB"
+END = 0xFE                                  # ends a game's moves, then comes the result byte
+PASS = 0xFF                                 # the next move is by the same player as the last one
+RESULTS = (None, "Player1", "Player2")      # result byte to winner
+PLAYERS = ("Player1", "Player2")
+
+# one archived game: its byte offset in the file, the raw move bytes (PASS bytes included), the winner or None and
+# the final position_key, None if the file has no checksums
+GameRecord = collections.namedtuple("GameRecord", "offset moves winner checksum")
+
+
+def encode_move(coords, direction):
+    """Return the byte for pushing the marble at coords in direction"""
+    row, column = coords
+    return (row * COLS + column) * 4 + DIRECTION_ORDER.index(direction)
+
+
+def decode_move(value):
+    """Return the (coords, direction) of a move byte"""
+    cell, direction = divmod(value, 4)
+    return divmod(cell, COLS), DIRECTION_ORDER[direction]
+
+
+def decode_moves(moves, players=PLAYERS):
+    """Generator yielding (player, coords, direction) for the move bytes of a GameRecord, player being
+    players[0] or players[1]"""
+    turn = 0
+    for value in moves:
+        if value == PASS:
+            turn ^= 1
+            continue
+        coords, direction = decode_move(value)
+        yield players[turn], coords, direction
+        turn ^= 1
+
+
+class RecordWriter:
+    """Streams games to an archive file. attach(game) records every move made on a KubaGame through its
+    MOVE_APPLIED events, and the record is finished when the game is won, when another game is attached or on
+    end_game/close. Moves can also be written directly with write_move"""
+    def __init__(self, path, checksum=True):
+        self.file = open(path, "wb")
+        self.checksum = checksum
+        self.file.write(HEADER.pack(MAGIC, VERSION, FLAG_CHECKSUM if checksum else 0))
+        self.game = None
+        self.listener = None
+        self.turn = None            # index in PLAYERS of the player expected to move next, None between games
+        self.games = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def attach(self, game):
+        """Start recording game, which must be at the standard starting position on a 7x7 board"""
+        if game.size != ROWS:
+            raise ValueError(f"only 7x7 games fit one byte per move, not {game.size}x{game.size}")
+        self.end_game()
+        self.game = game
+        self.listener = game.subscribe(self.on_event)
+
+    def on_event(self, event, data):
+        """KubaGame listener writing applied moves and ending the record when the game is won"""
+        if event == MOVE_APPLIED:
+            self.write_move(data["player"], data["coords"], data["direction"])
+        elif event == GAME_WON:
+            self.end_game()
+
+    def write_move(self, player, coords, direction):
+        """Append one move to the game being recorded"""
+        if self.turn is None:
+            self.turn = 0
+        mover = PLAYERS.index(player)
+        if mover != self.turn:
+            self.file.write(bytes((PASS, encode_move(coords, direction))))
+        else:
+            self.file.write(bytes((encode_move(coords, direction),)))
+        self.turn = mover ^ 1
+
+    def end_game(self, winner=None, position_key=None):
+        """Finish the current record. With a game attached its winner and position_key are used and it is
+        detached, otherwise they are given by the caller. Does nothing if no game was started"""
+        if self.game is not None:
+            winner, position_key = self.game.get_winner(), self.game.position_key()
+            self.game.unsubscribe(self.listener)
+            self.game = self.listener = None
+        elif self.turn is None:
+            return
+        self.file.write(bytes((END, RESULTS.index(winner))))
+        if self.checksum:
+            self.file.write(CHECKSUM.pack(position_key or 0))
+        self.turn = None
+        self.games += 1
+
+    def close(self):
+        """End the current game and close the file"""
+        if not self.file.closed:
+            self.end_game()
+            self.file.close()
+
+
+class RecordReader:
+    """Memory-mapped archive reader. Iterating yields GameRecords without decoding or copying the rest of the file,
+    and replay(record) plays one back a position at a time"""
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} Kuba record file")
+        self.checksum = bool(flags & FLAG_CHECKSUM)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmap and close the file"""
+        self.data.close()
+        self.file.close()
+
+    def __iter__(self):
+        data = self.data
+        offset = HEADER.size
+        while offset < len(data):
+            end = data.find(bytes((END,)), offset)
+            if end < 0:
+                raise ValueError(f"truncated game at byte {offset}")
+            winner = RESULTS[data[end + 1]]
+            checksum = CHECKSUM.unpack_from(data, end + 2)[0] if self.checksum else None
+            yield GameRecord(offset, data[offset:end], winner, checksum)
+            offset = end + 2 + (CHECKSUM.size if self.checksum else 0)
+
+    def replay(self, record, verify=True):
+        """Generator yielding a quiet KubaGame after each move of record, the same game object every time. With
+        verify, raises ValueError if a move is rejected or the final position does not match the checksum"""
+        game = KubaGame(quiet=True)
+        for ply, (player, coords, direction) in enumerate(decode_moves(record.moves, (game.player1, game.player2))):
+            result = game.make_move(player, coords, direction)
+            if verify and result != OK:
+                raise ValueError(f"game at byte {record.offset}: move {ply} {coords} {direction} rejected: {result}")
+            yield game
+        if verify and record.checksum is not None and game.position_key() != record.checksum:
+            raise ValueError(f"game at byte {record.offset}: final position does not match the checksum")
+
+    def final_position(self, record, verify=True):
+        """Return the KubaGame at the end of record"""
+        game = KubaGame(quiet=True)
+        for game in self.replay(record, verify):
+            pass
+        return game
+
+
+def generate(path, games, seed, checksum=True):
+    """Write games random games to path and return the number of moves written"""
+    rng = random.Random(seed)
+    plies = 0
+    with RecordWriter(path, checksum) as writer:
+        for _ in range(games):
+            game = KubaGame(quiet=True)
+            writer.attach(game)
+            while game.get_winner() is None:
+                moves = list(game.legal_moves(game.get_current_turn()))
+                if not moves:
+                    break
+                game.make_move(game.get_current_turn(), *rng.choice(moves))
+                plies += 1
+            writer.end_game()
+    return plies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write or summarise a Kuba record file")
+    parser.add_argument("path")
+    parser.add_argument("--generate", type=int, metavar="GAMES", help="write this many random games to path first")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-checksum", action="store_true")
+    parser.add_argument("--verify", action="store_true", help="replay every game and check its checksum")
+    args = parser.parse_args()
+
+    if args.generate:
+        start = time.perf_counter()
+        plies = generate(args.path, args.generate, args.seed, not args.no_checksum)
+        print(f"wrote {args.generate} games, {plies} moves in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    games = plies = 0
+    wins = collections.Counter()
+    with RecordReader(args.path) as reader:
+        for record in reader:
+            games += 1
+            plies += len(record.moves) - record.moves.count(PASS)
+            wins[record.winner] += 1
+            if args.verify:
+                reader.final_position(record)
+        size = len(reader.data)
+    print(f"{games} games, {plies} moves, {size} bytes ({size / max(plies, 1):.2f} bytes/move), "
+          f"wins {dict(wins)}, read in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
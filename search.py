@@ -0,0 +1,179 @@
+# Description: Alpha-beta AI for Kuba. Negamax search with iterative deepening under a per-move millisecond budget,
+# transposition table cutoffs and move ordering that tries the previous best move, then pushes that eject a marble,
+# then the rest. Works on any engine with legal_moves, push_move/pop_move, ejects and position_key, so it can search
+# a KubaGame directly or a BitboardKubaGame built from one. With a tablebase.Tablebase, positions it covers are
+# scored from the table instead of being searched.
+
+import collections
+import time
+
+from tablebase import LOSS, WIN
+from zobrist import EXACT, LOWER, UPPER, TranspositionTable
+
+WIN_SCORE = 100000              # score for a won position, less the number of plies it takes to get there
+CAPTURE_WEIGHT = 100            # per red marble captured, see get_captured
+MARBLE_WEIGHT = 60              # per own marble left on the board more than the opponent, see get_marble_count
+MOBILITY_WEIGHT = 2             # per legal move more than the opponent
+SAFETY_MS = 3                   # stop searching this long before the budget, to unwind and return in time
+MATE_BOUND = WIN_SCORE // 2     # scores beyond this are forced wins or losses, far above any evaluate score
+
+SearchResult = collections.namedtuple("SearchResult", "move score depth nodes seconds nps")
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time budget runs out"""
+
+
+def other_player(game, player):
+    """Return the opponent of player"""
+    return game.player2 if player == game.player1 else game.player1
+
+
+def to_table(score, ply):
+    """Return score, a win or loss counted in plies from the root, counted from the node ply plies deep instead, for
+    the transposition table, where the same position can be reached at any ply"""
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def from_table(score, ply):
+    """Return a transposition table score, see to_table, counted from the root again for a node ply plies deep"""
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def evaluate(game):
+    """Score the position for the side to move from captured reds, marbles left on the board and mobility"""
+    player = game.get_current_turn()
+    opponent = other_player(game, player)
+    white, black, _ = game.get_marble_count()
+    marbles = white - black if player == game.player1 else black - white
+    captures = game.get_captured(player) - game.get_captured(opponent)
+    mobility = len(list(game.legal_moves(player))) - len(list(game.legal_moves(opponent)))
+    return CAPTURE_WEIGHT * captures + MARBLE_WEIGHT * marbles + MOBILITY_WEIGHT * mobility
+
+
+class AlphaBetaSearch:
+    """Iterative deepening negamax with alpha-beta pruning. search(game) returns a SearchResult with the best move
+    found within time_limit_ms (it stops SAFETY_MS early so it returns inside the budget), the depth reached, the
+    nodes searched and nodes per second"""
+    def __init__(self, time_limit_ms=1000, max_depth=32, table=None, tablebase=None):
+        self.time_limit_ms = time_limit_ms
+        self.max_depth = max_depth
+        self.table = table if table is not None else TranspositionTable()
+        self.tablebase = tablebase
+        self.nodes = 0
+        self.deadline = 0.0
+
+    def order_moves(self, game, moves, best_move):
+        """Put best_move first, then the moves that capture a red marble, then the ones that push off an opponent
+        marble, then the rest"""
+        def priority(move):
+            if move == best_move:
+                return 0
+            ejected = game.ejects(*move)
+            if ejected == "R":
+                return 1
+            if ejected is not None:             # legal moves never push off their own marble
+                return 2
+            return 3
+        return sorted(moves, key=priority)
+
+    def negamax(self, game, depth, alpha, beta, ply):
+        """Return the score of the position for the side to move, searched depth plies deep"""
+        self.nodes += 1
+        if time.perf_counter() > self.deadline:   # every node: a node costs far more than reading the clock
+            raise SearchTimeout
+        if game.get_winner() is not None:       # the player who just moved has won
+            return -WIN_SCORE + ply
+        if self.tablebase is not None:
+            hit = self.tablebase.probe(game)
+            if hit is not None:
+                outcome, plies = hit
+                if outcome == WIN:
+                    return WIN_SCORE - ply - plies
+                if outcome == LOSS:
+                    return -WIN_SCORE + ply + plies
+                return 0
+        if depth == 0:
+            return evaluate(game)
+
+        key = game.position_key()
+        entry = self.table.probe(key)
+        best_move = None
+        if entry is not None:
+            best_move = entry[4]
+            if entry[1] >= depth:
+                value, flag = from_table(entry[2], ply), entry[3]
+                if flag == EXACT or (flag == LOWER and value >= beta) or (flag == UPPER and value <= alpha):
+                    return value
+
+        moves = list(game.legal_moves(game.get_current_turn()))
+        if not moves:                           # a player with no legal moves has lost
+            return -WIN_SCORE + ply
+        original_alpha = alpha
+        best_score = -WIN_SCORE - 1
+        for move in self.order_moves(game, moves, best_move):
+            game.push_move(game.get_current_turn(), *move)
+            try:
+                score = -self.negamax(game, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                game.pop_move()
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.store(key, depth, to_table(best_score, ply), flag, best_move)
+        return best_score
+
+    def search_root(self, game, depth, moves, best_move):
+        """Return (score, move) for the best of moves searched depth plies deep"""
+        alpha, beta = -WIN_SCORE - 1, WIN_SCORE + 1
+        best_score = -WIN_SCORE - 1
+        for move in self.order_moves(game, moves, best_move):
+            game.push_move(game.get_current_turn(), *move)
+            try:
+                score = -self.negamax(game, depth - 1, -beta, -alpha, 1)
+            finally:
+                game.pop_move()
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+        self.table.store(game.position_key(), depth, best_score, EXACT, best_move)
+        return best_score, best_move
+
+    def search(self, game):
+        """Search the position for the side to move until the time budget or max_depth runs out"""
+        start = time.perf_counter()
+        self.deadline = start + max(self.time_limit_ms - SAFETY_MS, 0) / 1000
+        self.nodes = 0
+        self.table.new_search()
+        moves = list(game.legal_moves(game.get_current_turn()))
+        best_move = moves[0] if moves else None
+        best_score = evaluate(game) if moves else -WIN_SCORE
+        depth_reached = 0
+        for depth in range(1, self.max_depth + 1 if moves else 1):
+            try:
+                best_score, best_move = self.search_root(game, depth, moves, best_move)
+            except SearchTimeout:               # keep the result of the last depth that finished
+                break
+            depth_reached = depth
+            if abs(best_score) >= MATE_BOUND:   # forced win or loss found, no need to look deeper
+                break
+        seconds = time.perf_counter() - start
+        return SearchResult(best_move, best_score, depth_reached, self.nodes, seconds,
+                            self.nodes / seconds if seconds else 0.0)
@@ -0,0 +1,323 @@
+# Description: asyncio server hosting many Kuba games from one process. Clients talk newline-delimited JSON over
+# TCP: join a session by id as Player1, Player2, host (both sides, like the local pygame window) or spectator, then
+# send select and move commands with the same meaning as KubaGame.select and set_direction. Every applied move is
+# broadcast to everyone in the session as a board delta. Each client has a bounded outgoing queue and is
+# disconnected when it falls further behind than that, and sessions nobody has touched for idle_timeout seconds
+# are evicted.
+#
+#   python server.py --port 8765
+#
+# Commands, one JSON object per line:
+#   {"cmd": "join", "session": "abc", "role": "Player1"}    -> joined, with the full board; "size" picks the board
+#                                                              size of a new session (see KubaGame)
+#   {"cmd": "select", "row": 6, "col": 5}                   -> selected or rejected
+#   {"cmd": "move", "direction": "F"}                       -> moved (to everyone) or rejected; "row" and "col" can be
+#                                                              given to select and move in one command
+#   {"cmd": "leave"} / {"cmd": "stats"}
+# Messages sent back have a "type": joined, selected, moved, rejected, error, left, evicted or stats.
+
+import argparse
+import asyncio
+import json
+import time
+
+from main import GAME_WON, MOVE_APPLIED, MOVE_REJECTED, ROWS, SELECTED, KubaGame
+
+DEFAULT_PORT = 8765
+IDLE_TIMEOUT = 300.0            # seconds without a command before a session is evicted
+QUEUE_LIMIT = 256               # messages waiting to be written to a client before it is dropped as too slow
+MAX_LINE = 4096                 # longest command line accepted
+ROLES = ("Player1", "Player2", "host", "spectator")
+
+
+def encode(message):
+    """Return message as one NDJSON line"""
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+
+class Client:
+    """One connection. Messages are queued by send and written by write_loop, so a slow reader never blocks the game
+    loop: when the queue is full the client is closed instead"""
+    def __init__(self, reader, writer, queue_limit):
+        self.reader = reader
+        self.writer = writer
+        self.queue = asyncio.Queue(queue_limit)
+        self.session = None
+        self.role = None
+        self.closed = False
+        self.task = asyncio.ensure_future(self.write_loop())
+
+    def send(self, line):
+        """Queue an encoded line. Returns False if the client is closed or was just dropped for being too slow"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.close()
+            return False
+        return True
+
+    async def write_loop(self):
+        try:
+            while True:
+                line = await self.queue.get()
+                self.writer.write(line)
+                await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.task is not asyncio.current_task():
+                self.task.cancel()
+            self.writer.close()
+
+
+class Session:
+    """A KubaGame shared by the clients that joined it"""
+    def __init__(self, session_id, size=ROWS):
+        self.id = session_id
+        self.game = KubaGame(quiet=True, size=size)
+        self.events = []                # events from the command being handled, see Server.flush
+        self.game.subscribe(lambda event, data: self.events.append((event, data)))
+        self.members = {}               # Client: role
+        self.last_active = time.monotonic()
+        self.moves = 0
+
+    def controls(self, role):
+        """Return the players a client with role moves for"""
+        if role == "host":
+            return self.game.player1, self.game.player2
+        if role in (self.game.player1, self.game.player2):
+            return (role,)
+        return ()
+
+    def taken(self, role, client=None):
+        """Return True if a player role clashes with one already in the session, not counting client's own"""
+        players = set(self.controls(role))
+        return any(players & set(self.controls(other))
+                   for member, other in self.members.items() if member is not client)
+
+    def snapshot(self):
+        """Return the full board and score"""
+        game = self.game
+        board = ["".join(game.get_marble((row, column)) for column in range(game.size)) for row in range(game.size)]
+        return {"session": self.id, "board": board, **self.status()}
+
+    def status(self):
+        game = self.game
+        return {"turn": game.get_current_turn(), "points": [game.player1_points, game.player2_points],
+                "winner": game.get_winner()}
+
+
+class Server:
+    """Maps session ids to Sessions and runs the command protocol for every connection"""
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, queue_limit=QUEUE_LIMIT, max_sessions=None):
+        self.idle_timeout = idle_timeout
+        self.queue_limit = queue_limit
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.clients = set()
+        self.handlers = set()           # handle_client tasks, waited for by close
+        self.moves = 0
+        self.dropped = 0
+        self.evicted = 0
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT):
+        """Start listening and evicting idle sessions. Returns the asyncio server"""
+        self.server = await asyncio.start_server(self.handle_client, host, port, limit=MAX_LINE, backlog=4096)
+        self.evictor = asyncio.ensure_future(self.evict_loop())
+        return self.server
+
+    async def close(self):
+        """Stop listening and disconnect every client"""
+        self.evictor.cancel()
+        self.server.close()
+        for client in list(self.clients):
+            client.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        client = Client(reader, writer, self.queue_limit)
+        self.clients.add(client)
+        self.handlers.add(asyncio.current_task())
+        try:
+            while not client.closed:
+                try:
+                    line = await reader.readline()
+                except ValueError:                  # longer than MAX_LINE
+                    client.send(encode({"type": "error", "reason": "line_too_long"}))
+                    break
+                if not line:
+                    break
+                self.handle_line(client, line)
+        except ConnectionError:
+            pass
+        finally:
+            self.leave(client)
+            self.clients.discard(client)
+            self.handlers.discard(asyncio.current_task())
+            client.close()
+
+    def handle_line(self, client, line):
+        """Run one command from client"""
+        try:
+            message = json.loads(line)
+            command = message["cmd"]
+        except (ValueError, KeyError, TypeError):
+            client.send(encode({"type": "error", "reason": "bad_command"}))
+            return
+        handler = getattr(self, f"command_{command}", None) if isinstance(command, str) else None
+        if handler is None:
+            client.send(encode({"type": "error", "reason": "unknown_command"}))
+            return
+        try:
+            handler(client, message)
+        except (KeyError, TypeError, ValueError):
+            client.send(encode({"type": "error", "reason": "bad_arguments"}))
+        if client.closed and client.session is not None:
+            self.dropped += 1
+            self.leave(client)
+
+    def command_join(self, client, message):
+        session_id = str(message["session"])
+        role = message.get("role", "spectator")
+        if role not in ROLES:
+            client.send(encode({"type": "error", "reason": "bad_role"}))
+            return
+        session = self.sessions.get(session_id)
+        if session is None:
+            if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+                client.send(encode({"type": "error", "reason": "server_full"}))
+                return
+            session = Session(session_id, int(message.get("size", ROWS)))  # a bad size fails before leaving
+        if session.taken(role, client):
+            client.send(encode({"type": "error", "reason": "role_taken"}))
+            return
+        self.leave(client)                      # only once the new session is known to accept the client
+        self.sessions[session_id] = session
+        session.members[client] = role
+        session.last_active = time.monotonic()
+        client.session, client.role = session, role
+        client.send(encode({"type": "joined", "role": role, **session.snapshot()}))
+
+    def command_leave(self, client, message):
+        self.leave(client)
+        client.send(encode({"type": "left"}))
+
+    def command_stats(self, client, message):
+        client.send(encode({"type": "stats", "sessions": len(self.sessions), "clients": len(self.clients),
+                            "moves": self.moves, "dropped": self.dropped, "evicted": self.evicted}))
+
+    def command_select(self, client, message):
+        session = self.playing(client)
+        if session is not None:
+            session.game.select(int(message["row"]), int(message["col"]))
+            self.flush(session, client)
+
+    def command_move(self, client, message):
+        session = self.playing(client)
+        if session is None:
+            return
+        game = session.game
+        if "row" in message:
+            if not game.select(int(message["row"]), int(message["col"])):
+                self.flush(session, client)
+                return
+            session.events.clear()              # only the move is reported
+        if game.set_direction(str(message["direction"])) is None and game.get_winner() is None:
+            client.send(encode({"type": "rejected", "reason": "nothing_selected"}))
+        self.flush(session, client)
+
+    def playing(self, client):
+        """Return the client's session if it may move now, otherwise send the reason and return None"""
+        session = client.session
+        if session is None:
+            client.send(encode({"type": "error", "reason": "no_session"}))
+            return None
+        session.last_active = time.monotonic()
+        if session.game.get_current_turn() not in session.controls(client.role):
+            client.send(encode({"type": "rejected", "reason": "not_your_turn"}))
+            return None
+        return session
+
+    def flush(self, session, client):
+        """Turn the events a command produced into messages: rejections and selections go to client, a move is
+        broadcast to the whole session as the cells it changed"""
+        game = session.game
+        moved = None
+        for event, data in session.events:
+            if event == MOVE_REJECTED:
+                client.send(encode({"type": "rejected", "reason": data["reason"]}))
+            elif event == SELECTED:
+                client.send(encode({"type": "selected", "coords": data["coords"]}))
+            elif event == MOVE_APPLIED:
+                moved = {"type": "moved", "player": data["player"], "coords": data["coords"],
+                         "direction": data["direction"],
+                         "changes": [[row, column, game.get_marble((row, column))] for row, column in data["cells"]]}
+            elif event == GAME_WON and moved is not None:
+                moved["won"] = data["reason"]
+        session.events.clear()
+        if moved is not None:
+            session.moves += 1
+            self.moves += 1
+            moved.update(session.status())
+            line = encode(moved)
+            for member in list(session.members):
+                if not member.send(line):
+                    self.dropped += 1
+                    self.leave(member)
+
+    def leave(self, client):
+        """Take client out of its session, and drop the session if it was the last one in a finished game"""
+        session = client.session
+        if session is not None:
+            session.members.pop(client, None)
+            client.session = client.role = None
+            if not session.members and session.game.get_winner() is not None:  # nobody left to look at it
+                self.sessions.pop(session.id, None)
+
+    async def evict_loop(self):
+        """Evict sessions idle for longer than idle_timeout"""
+        while True:
+            await asyncio.sleep(min(self.idle_timeout / 4, 5.0))
+            cutoff = time.monotonic() - self.idle_timeout
+            for session in [session for session in self.sessions.values() if session.last_active < cutoff]:
+                line = encode({"type": "evicted", "session": session.id})
+                for member in list(session.members):
+                    member.send(line)
+                    self.leave(member)
+                self.sessions.pop(session.id, None)     # leave has dropped it already if the game was over
+                self.evicted += 1
+
+
+async def serve(host, port, idle_timeout, queue_limit, max_sessions):
+    server = Server(idle_timeout, queue_limit, max_sessions)
+    listener = await server.start(host, port)
+    print(f"serving Kuba on {host}:{port}", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kuba game server, newline-delimited JSON over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT, help="seconds before an idle session "
+                                                                                  "is evicted")
+    parser.add_argument("--queue-limit", type=int, default=QUEUE_LIMIT, help="messages buffered per client")
+    parser.add_argument("--max-sessions", type=int)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.idle_timeout, args.queue_limit, args.max_sessions))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# Description: Immutable Kuba positions. A GameState holds one bitmask per colour (bit row * size + column set
+# where that colour has a marble), both capture counts, the side to move, the winner and the ko hash, and nothing
+# else: no Piece objects, no selection and no undo stack. It is a tuple, so it is hashable and can be compared and
+# used as a dict key, and apply returns a new state instead of changing the old one, so any number of alternative
+# lines can share one parent. States pickle to a few dozen bytes through pack, for shipping positions between
+# processes. KubaGame.get_state and KubaGame.from_state convert between the two.
+
+import collections
+import struct
+
+from zobrist import piece_keys, position_key
+
+PLAYERS = ("Player1", "Player2")
+
+# make_move and apply results: OK, or the reason the move was rejected
+OK = "ok"
+GAME_OVER = "game_over"
+OFF_BOARD = "off_board"
+OPPONENT_MARBLE = "opponent_marble"
+RED_MARBLE = "red_marble"
+EMPTY_TILE = "empty_tile"
+BAD_DIRECTION = "bad_direction"
+NO_ROOM = "no_room"
+OWN_MARBLE = "own_marble"
+KO = "ko"
+
+COLOURS = "WBR"                     # masks[0] is white (Player1), masks[1] black (Player2), masks[2] red
+DIRECTIONS = {"R": (0, 1), "L": (0, -1), "F": (-1, 0), "B": (1, 0)}  # (row, column) step of a push
+HEADER = struct.Struct("<BBBBbQ")   # size, player1_points, player2_points, turn, winner (-1 for None), ko_hash
+
+_RAY_TABLES = {}
+
+
+def starting_board(size):
+    """Return the starting board for a size x size game: a block of (size - 1) // 3 squared marbles of each colour
+    in every corner, white in the top left and bottom right, and a diamond of reds with radius (size - 3) // 2 in
+    the middle. For size 7 this is the standard 8 white, 8 black and 13 red layout. Raises ValueError unless size
+    is odd and from 5 to 17"""
+    if size < 5 or size % 2 == 0 or size > 17:     # bigger boards need more than zobrist.MAX_CAPTURES keys
+        raise ValueError(f"board size must be odd and between 5 and 17, not {size}")
+    corner = (size - 1) // 3
+    radius = (size - 3) // 2
+    middle = size // 2
+    board = [["[R]" if abs(row - middle) + abs(column - middle) <= radius else "[ ]" for column in range(size)]
+             for row in range(size)]
+    last = size - 1
+    for row in range(corner):
+        for column in range(corner):
+            board[row][column] = board[last - row][last - column] = "[W]"
+            board[row][last - column] = board[last - row][column] = "[B]"
+    return board
+
+
+def build_rays(rows, cols):
+    """Return (rays, behind) for a rows x cols board. rays[direction][row][column] is the tuple of (row, column)
+    cells from that cell to the edge in direction, starting with the cell itself. behind[direction][row][column] is
+    the cell that must be empty to push from there, or None on the edge"""
+    rays, behind = {}, {}
+    for direction, (d_row, d_column) in DIRECTIONS.items():
+        rays[direction] = [[None] * cols for _ in range(rows)]
+        behind[direction] = [[None] * cols for _ in range(rows)]
+        for row in range(rows):
+            for column in range(cols):
+                ray = []
+                cell_row, cell_column = row, column
+                while 0 <= cell_row < rows and 0 <= cell_column < cols:
+                    ray.append((cell_row, cell_column))
+                    cell_row += d_row
+                    cell_column += d_column
+                rays[direction][row][column] = tuple(ray)
+                if 0 <= row - d_row < rows and 0 <= column - d_column < cols:
+                    behind[direction][row][column] = (row - d_row, column - d_column)
+    return rays, behind
+
+
+def board_rays(size):
+    """Return build_rays(size, size), built once per board size"""
+    tables = _RAY_TABLES.get(size)
+    if tables is None:
+        tables = _RAY_TABLES[size] = build_rays(size, size)
+    return tables
+
+
+def reds_to_win(size):
+    """Return the reds a player must capture to win a size x size game, more than half of those on the starting
+    board"""
+    radius = (size - 3) // 2
+    return (2 * radius * radius + 2 * radius + 1) // 2 + 1      # the diamond starting_board fills with reds
+
+
+def unpack(data):
+    """Return the GameState packed into data by GameState.pack"""
+    size, points1, points2, turn, winner, ko_hash = HEADER.unpack_from(data)
+    width = (size * size + 7) // 8
+    masks = tuple(int.from_bytes(data[HEADER.size + width * index:HEADER.size + width * (index + 1)], "little")
+                  for index in range(3))
+    return GameState.make(masks, points1, points2, turn, None if winner < 0 else winner, ko_hash, size)
+
+
+class GameState(collections.namedtuple("GameState", "masks player1_points player2_points turn winner ko_hash "
+                                                    "zobrist size")):
+    """A Kuba position. masks is the (white, black, red) tuple of bitmasks, turn 0 when Player1 is to move and 1 for
+    Player2, winner None or the winning side's 0 or 1, ko_hash the board hash the next move can not recreate (0 when
+    there is none) and zobrist the board hash, the same values KubaGame keeps"""
+    __slots__ = ()
+
+    @classmethod
+    def make(cls, masks, player1_points=0, player2_points=0, turn=0, winner=None, ko_hash=0, size=7):
+        """Return a state with its zobrist hash worked out from masks"""
+        keys = piece_keys(size)
+        board_hash = 0
+        for colour, mask in zip(COLOURS, masks):
+            while mask:
+                square = mask & -mask
+                mask ^= square
+                board_hash ^= keys[square.bit_length() - 1][colour]
+        return cls(tuple(masks), player1_points, player2_points, turn, winner, ko_hash, board_hash, size)
+
+    @classmethod
+    def start(cls, size=7):
+        """Return the starting position of a size x size game, Player1 to move"""
+        return cls.from_board(starting_board(size))
+
+    @classmethod
+    def from_board(cls, board, player1_points=0, player2_points=0, turn=0, winner=None, ko_hash=0):
+        """Return a state from rows of "[W]", "[B]", "[R]" and "[ ]" tiles, like KubaGame.board"""
+        size = len(board)
+        masks = [0, 0, 0]
+        for row in range(size):
+            for column in range(size):
+                tile = board[row][column]
+                if tile != "[ ]":
+                    masks[COLOURS.index(tile[1])] |= 1 << (row * size + column)
+        return cls.make(masks, player1_points, player2_points, turn, winner, ko_hash, size)
+
+    def __reduce__(self):
+        return unpack, (self.pack(),)
+
+    def pack(self):
+        """Return the state as bytes: HEADER then the three masks, (size * size + 7) // 8 bytes each"""
+        width = (self.size * self.size + 7) // 8
+        return (HEADER.pack(self.size, self.player1_points, self.player2_points, self.turn,
+                            -1 if self.winner is None else self.winner, self.ko_hash)
+                + b"".join(mask.to_bytes(width, "little") for mask in self.masks))
+
+    def board(self):
+        """Return the board as rows of tiles, like KubaGame.board"""
+        size = self.size
+        board = [["[ ]"] * size for _ in range(size)]
+        for colour, mask in zip(COLOURS, self.masks):
+            while mask:
+                square = mask & -mask
+                mask ^= square
+                row, column = divmod(square.bit_length() - 1, size)
+                board[row][column] = f"[{colour}]"
+        return board
+
+    def current_player(self):
+        """Return the name of the player to move"""
+        return PLAYERS[self.turn]
+
+    def get_winner(self):
+        """Return the winner's name, or None"""
+        return None if self.winner is None else PLAYERS[self.winner]
+
+    def win_reds(self):
+        """Return the reds a player must capture to win, see reds_to_win"""
+        return reds_to_win(self.size)
+
+    def position_key(self):
+        """Return the transposition table key, the same value KubaGame.position_key gives for the position"""
+        return position_key(self.zobrist, self.turn == 1, self.player1_points, self.player2_points, self.ko_hash)
+
+    def push(self, cell, direction):
+        """Return (ray, end, pushes_off, board_hash) for the side to move pushing its marble on cell in direction,
+        or the reason it cant. ray is the board_rays ray as cell indices, ray[:end + 1] the cells the push writes to
+        as in KubaGame.push_line, and board_hash the board hash after it"""
+        colour = self.colour_at(cell)
+        if colour is None:
+            return EMPTY_TILE
+        if colour == "R":
+            return RED_MARBLE
+        if colour != COLOURS[self.turn]:
+            return OPPONENT_MARBLE
+        if direction not in DIRECTIONS:
+            return BAD_DIRECTION
+        size = self.size
+        own = self.masks[self.turn]
+        occupied = self.masks[0] | self.masks[1] | self.masks[2]
+        rays, behind = board_rays(size)
+        row, column = divmod(cell, size)
+        back = behind[direction][row][column]
+        if back is not None and occupied >> (back[0] * size + back[1]) & 1:
+            return NO_ROOM
+        ray = [ray_row * size + ray_column for ray_row, ray_column in rays[direction][row][column]]
+        end, pushes_off = len(ray) - 1, True
+        for index in range(1, len(ray)):
+            if not occupied >> ray[index] & 1:
+                end, pushes_off = index, False
+                break
+        if pushes_off and own >> ray[end] & 1:
+            return OWN_MARBLE
+        keys = piece_keys(self.size)
+        board_hash = self.zobrist
+        previous = None
+        for square in ray[:end + 1]:                # every cell loses its marble and gains the one behind it
+            colour = self.colour_at(square)
+            if colour is not None:
+                board_hash ^= keys[square][colour]
+            if previous is not None:
+                board_hash ^= keys[square][previous]
+            previous = colour
+        if self.ko_hash and board_hash == self.ko_hash:
+            return KO
+        return ray, end, pushes_off, board_hash
+
+    def colour_at(self, cell):
+        """Return "W", "B" or "R" for the marble on cell, or None if it is empty"""
+        for colour, mask in zip(COLOURS, self.masks):
+            if mask >> cell & 1:
+                return colour
+        return None
+
+    def legal_moves(self):
+        """Generator yielding every (coords, direction) the side to move can play, in the order
+        KubaGame.legal_moves gives them"""
+        if self.winner is not None:
+            return
+        mask = self.masks[self.turn]
+        while mask:
+            square = mask & -mask
+            mask ^= square
+            cell = square.bit_length() - 1
+            for direction in DIRECTIONS:
+                if not isinstance(self.push(cell, direction), str):
+                    yield divmod(cell, self.size), direction
+
+    def apply(self, coords, direction):
+        """Return the state after the side to move pushes its marble at coords in direction. Raises ValueError with
+        the reason (GAME_OVER, NO_ROOM, KO, ...) if the move cant be made"""
+        row, column = coords
+        if self.winner is not None:
+            raise ValueError(GAME_OVER)
+        if not 0 <= row < self.size or not 0 <= column < self.size:
+            raise ValueError(OFF_BOARD)
+        line = self.push(row * self.size + column, direction)
+        if isinstance(line, str):
+            raise ValueError(line)
+        ray, end, pushes_off, board_hash = line
+
+        masks = list(self.masks)
+        ejected = self.colour_at(ray[end]) if pushes_off else None
+        for index in range(end, 0, -1):             # from the far end, like KubaGame.shift_line
+            colour = self.colour_at(ray[index - 1])
+            for value in range(3):
+                masks[value] &= ~(1 << ray[index])
+            if colour is not None:
+                masks[COLOURS.index(colour)] |= 1 << ray[index]
+        for value in range(3):
+            masks[value] &= ~(1 << ray[0])
+        points = [self.player1_points, self.player2_points]
+        if ejected == "R":
+            points[self.turn] += 1
+
+        opponent = 1 - self.turn
+        occupied = masks[0] | masks[1] | masks[2]
+        ko_hash = 0                                 # the test KubaGame.ko_after_push makes
+        if not pushes_off and masks[opponent] >> ray[end] & 1 and (end + 1 == len(ray)
+                                                                  or not occupied >> ray[end + 1] & 1):
+            ko_hash = self.zobrist
+        state = GameState(tuple(masks), points[0], points[1], opponent, None, ko_hash, board_hash, self.size)
+        if not masks[opponent] or points[self.turn] == self.win_reds() or next(state.legal_moves(), None) is None:
+            state = state._replace(winner=self.turn)
+        return state
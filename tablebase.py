@@ -0,0 +1,428 @@
+# Description: Endgame tablebase for Kuba. Every position with at most max_marbles marbles per side and max_reds
+# red marbles is solved by retrograde analysis with the same push rules as BitboardKubaGame, and stored as one
+# signed byte: 0 for a draw, plies + 1 when the side to move wins and -(plies + 1) when it loses, plies being the
+# distance to the end of the game with best play (quickest win, longest loss).
+#
+# Positions are kept relative to the side to move: the mover's marbles, the opponent's marbles, the reds, and how
+# many more reds each side needs to capture (capped at reds + 1, which means the 7 red rule can no longer decide
+# the game). Colours do not matter, so White and Black to move share one table. Each material signature
+# (own, opponent, reds) is a table indexed combinatorially: the mover's marbles are folded under the 8 symmetries
+# of the board into a canonical set, then the opponent's marbles and the reds are ranked among the cells left.
+#
+# Solving follows the ko rule: a push the opponent could push straight back leads to a position, kept in memory
+# while its tables are solved, where that push back is ruled out. Only positions without a ko are stored, so probe
+# does not use the table for positions where ko_hash rules out a move.
+#
+# Pure Python, so the default limit is small:
+#
+#   python tablebase.py kuba.tb --marbles 1 --reds 1
+#
+# and a file is probed through mmap in O(1) by Tablebase(path).probe(game).
+
+import argparse
+import array
+import collections
+import itertools
+import mmap
+import struct
+import time
+
+from bitboard import COLS, EDGE, OPPOSITE, ROWS, line_from, shift
+
+CELLS = ROWS * COLS
+DIRECTIONS = ("R", "L", "F", "B")
+WIN_REDS = 7                            # reds a player has to capture to win
+MAGIC = b"KUTB"
+VERSION = 2                             # 1 solved without the ko rule
+HEADER = struct.Struct("<4sBBBx")       # magic, version, max_marbles, max_reds
+WIN, DRAW, LOSS = 1, 0, -1
+MAX_PLIES = 126                         # longest distance a signed byte can hold
+OPPONENT_EJECTED, RED_EJECTED = 1, 2
+
+BINOMIAL = [[1] + [0] * CELLS for _ in range(CELLS + 1)]
+for _n in range(1, CELLS + 1):
+    for _k in range(1, _n + 1):
+        BINOMIAL[_n][_k] = BINOMIAL[_n - 1][_k - 1] + BINOMIAL[_n - 1][_k]
+
+
+def _symmetries():
+    """Return the 8 symmetries of the board as tuples mapping each cell to its image, the identity first"""
+    maps = []
+    for transpose in (False, True):
+        for flip_rows in (False, True):
+            for flip_columns in (False, True):
+                image = []
+                for cell in range(CELLS):
+                    row, column = divmod(cell, COLS)
+                    if transpose:
+                        row, column = column, row
+                    if flip_rows:
+                        row = ROWS - 1 - row
+                    if flip_columns:
+                        column = COLS - 1 - column
+                    image.append(row * COLS + column)
+                maps.append(tuple(image))
+    return maps
+
+
+SYMMETRIES = _symmetries()
+
+
+def cells_of(mask):
+    """Return the cell indices set in mask, lowest first"""
+    cells = []
+    while mask:
+        square = mask & -mask
+        mask ^= square
+        cells.append(square.bit_length() - 1)
+    return cells
+
+
+def map_mask(mask, image):
+    """Return mask with every cell moved by a symmetry"""
+    mapped = 0
+    for cell in cells_of(mask):
+        mapped |= 1 << image[cell]
+    return mapped
+
+
+def rank(mask, taken=0):
+    """Return the combinatorial rank of the cells in mask among the cells not in taken"""
+    total = 0
+    for position, cell in enumerate(cells_of(mask)):
+        total += BINOMIAL[cell - bin(taken & ((1 << cell) - 1)).count("1")][position + 1]
+    return total
+
+
+def successors(own, opp, red):
+    """Generator yielding (ejected, own, opp, red, reversible) for every legal push of the side to move, with the
+    masks after the push, ejected OPPONENT_EJECTED, RED_EJECTED or None and reversible True if the opponent could
+    push the line straight back, which the ko rule then rules out. Same rules as BitboardKubaGame.make_move, without
+    checking the ko rule"""
+    occupied = own | opp | red
+    for cell in cells_of(own):
+        square = 1 << cell
+        for direction in DIRECTIONS:
+            if shift(square, OPPOSITE[direction]) & occupied:
+                continue                        # no room to move marble
+            line, last = line_from(square, direction, occupied)
+            ejected = last & EDGE[direction]
+            if ejected and own & last:          # cant push off own marble
+                continue
+            moved = (own & ~line) | shift(own & line, direction)
+            moved_opp = (opp & ~line) | shift(opp & line, direction)
+            moved_red = (red & ~line) | shift(red & line, direction)
+            if not ejected:
+                gap = shift(last, direction)    # where the far end marble went, see BitboardKubaGame.make_move
+                reversible = bool(opp & last) and not shift(gap, direction) & occupied
+                yield None, moved, moved_opp, moved_red, reversible
+            else:
+                yield OPPONENT_EJECTED if opp & last else RED_EJECTED, moved, moved_opp, moved_red, False
+
+
+def decode(value):
+    """Return (WIN, LOSS or DRAW, plies) for a stored byte, plies None for a draw"""
+    if value > 0:
+        return WIN, value - 1
+    if value < 0:
+        return LOSS, -value - 1
+    return DRAW, None
+
+
+class Layout:
+    """Where every position lives in a tablebase file with the given limits. Tables are ordered by total material so
+    a table only depends on the ones before it and the one with the two marble counts swapped"""
+    def __init__(self, max_marbles, max_reds):
+        self.max_marbles = max_marbles
+        self.max_reds = max_reds
+        self.canonical = {}                     # own count: list of canonical own masks
+        self.classes = {}                       # own count: {rank(own): (class, canonical mask, symmetries)}
+        for count in range(1, max_marbles + 1):
+            self.fold(count)
+        tables = [(own, opp, reds) for own in range(1, max_marbles + 1) for opp in range(1, max_marbles + 1)
+                  for reds in range(max_reds + 1)]
+        self.tables = sorted(tables, key=lambda table: (sum(table), table))
+        self.offsets = {}
+        self.size = 0
+        for table in self.tables:
+            self.offsets[table] = self.size
+            self.size += self.table_size(table)
+
+    def fold(self, count):
+        """Find the canonical sets of count cells under the board symmetries: the image with the lowest rank"""
+        folded = []
+        for cells in itertools.combinations(range(CELLS), count):
+            mask = sum(1 << cell for cell in cells)
+            images = [map_mask(mask, image) for image in SYMMETRIES]
+            folded.append((mask, images, min(images, key=rank)))
+        canonical = [mask for mask, _, smallest in folded if smallest == mask]
+        index = {mask: position for position, mask in enumerate(canonical)}
+        self.canonical[count] = canonical
+        self.classes[count] = {rank(mask): (index[smallest], smallest, [image for image, mapped in
+                                                                         zip(SYMMETRIES, images) if mapped == smallest])
+                               for mask, images, smallest in folded}
+
+    def table_size(self, table):
+        """Return the number of positions in a (own, opp, reds) table, including slots folded away"""
+        own, opp, reds = table
+        return (len(self.canonical[own]) * BINOMIAL[CELLS - own][opp] * BINOMIAL[CELLS - own - opp][reds]
+                * (reds + 1) ** 2)
+
+    def orient(self, own, opp, red, own_count):
+        """Return (position, key, image) for a board: the canonical own class, the ranks of the opponent's marbles
+        and the reds in it and the symmetry that maps the board onto the canonical one"""
+        position, canonical, images = self.classes[own_count][rank(own)]
+        best = best_image = None
+        for image in images:
+            mapped_opp = map_mask(opp, image)
+            key = (rank(mapped_opp, canonical), rank(map_mask(red, image), canonical | mapped_opp))
+            if best is None or key < best:
+                best, best_image = key, image
+        return position, best, best_image
+
+    def slot(self, own, opp, red, own_count, opp_count, reds):
+        """Return the board's index within its table, before the capture needs are added"""
+        position, best, _ = self.orient(own, opp, red, own_count)
+        return (position * BINOMIAL[CELLS - own_count][opp_count] + best[0]) \
+            * BINOMIAL[CELLS - own_count - opp_count][reds] + best[1]
+
+    def index(self, own, opp, red, need_own, need_opp):
+        """Return the position's index in the file. need_own and need_opp must already be capped at reds + 1"""
+        own_count, opp_count, reds = bin(own).count("1"), bin(opp).count("1"), bin(red).count("1")
+        base = self.offsets[(own_count, opp_count, reds)]
+        slot = self.slot(own, opp, red, own_count, opp_count, reds)
+        return base + (slot * (reds + 1) + need_own - 1) * (reds + 1) + need_opp - 1
+
+    def boards(self, table):
+        """Generator yielding (own, opp, red) for every canonical board of table, each once"""
+        own_count, opp_count, reds = table
+        opp_slots = BINOMIAL[CELLS - own_count][opp_count]
+        red_slots = BINOMIAL[CELLS - own_count - opp_count][reds]
+        for position, own in enumerate(self.canonical[own_count]):
+            free = [cell for cell in range(CELLS) if not own >> cell & 1]
+            for opp_cells in itertools.combinations(free, opp_count):
+                opp = sum(1 << cell for cell in opp_cells)
+                base = (position * opp_slots + rank(opp, own)) * red_slots
+                left = [cell for cell in free if not opp >> cell & 1]
+                for red_cells in itertools.combinations(left, reds):
+                    red = sum(1 << cell for cell in red_cells)
+                    # boards whose own marbles are symmetric can be folded further, keep the canonical one
+                    if self.slot(own, opp, red, own_count, opp_count, reds) == base + rank(red, own | opp):
+                        yield own, opp, red
+
+
+def generate(max_marbles=1, max_reds=1, progress=None):
+    """Solve every table within the limits and return (layout, values) with values an array('b') of the file's
+    bytes after the header"""
+    layout = Layout(max_marbles, max_reds)
+    values = array.array("b", bytes(layout.size))
+    done = set()
+    for table in layout.tables:
+        if table in done:
+            continue
+        own_count, opp_count, reds = table
+        group = [table] if own_count == opp_count else [table, (opp_count, own_count, reds)]
+        start = time.perf_counter()
+        solved = solve_group(layout, values, group)
+        done.update(group)
+        if progress is not None:
+            progress(group, solved, time.perf_counter() - start)
+    return layout, values
+
+
+def solve_group(layout, values, group):
+    """Retrograde analysis of the tables in group, which only depend on each other and on tables solved before.
+    Positions decided by moves into earlier tables seed distance buckets, then each bucket resolves its positions
+    and passes wins and losses back to their predecessors in distance order. A reversible push leads to a ko
+    position, numbered from layout.size up and solved alongside, where pushing straight back is ruled out. Returns
+    the number of positions stored"""
+    preds = collections.defaultdict(list)
+    remaining = {}                              # node: same group children not yet known to win, None if node wins
+    longest = {}                                # node: longest known win among its children
+    buckets = collections.defaultdict(list)     # plies: [(node, WIN or LOSS)]
+    ko_nodes = {}                               # (node, board the next move can not recreate): ko position number
+    ko_values = array.array("b")                # stored byte of every ko position, like values
+    pending = []                                # ko positions to expand: (node, own, opp, red, needs, forbidden)
+
+    def ko_node(node, own, opp, red, need_own, need_opp, forbidden):
+        """Return the number of the position node with forbidden as the board the ko rule rules out, seen in the
+        canonical orientation of the board so symmetric copies share one number"""
+        _, _, image = layout.orient(own, opp, red, bin(own).count("1"))
+        own, opp, red = map_mask(own, image), map_mask(opp, image), map_mask(red, image)
+        key = (node, tuple(map_mask(mask, image) for mask in forbidden))
+        number = ko_nodes.get(key)
+        if number is None:
+            number = ko_nodes[key] = layout.size + len(ko_values)
+            ko_values.append(0)
+            pending.append((number, own, opp, red, need_own, need_opp, key[1]))
+        return number
+
+    def expand(node, own, opp, red, need_own, need_opp, moves, forbidden=None):
+        """Link node to its same group children and seed a bucket if the moves into earlier tables decide it"""
+        opp_count, reds = bin(opp).count("1"), bin(red).count("1")
+        win, children, draws, longest_win = None, [], 0, -1
+        for ejected, moved, moved_opp, moved_red, reversible in moves:
+            if (moved, moved_opp, moved_red) == forbidden:     # recreates the board before the opponent's move
+                continue
+            if ejected == OPPONENT_EJECTED and opp_count == 1 or ejected == RED_EJECTED and need_own == 1:
+                win = 1                         # wins on the spot
+                continue
+            if ejected == RED_EJECTED:          # the opponent moves next, with one red fewer to go for
+                child = layout.index(moved_opp, moved, moved_red, min(need_opp, reds), need_own - 1)
+            else:
+                child = layout.index(moved_opp, moved, moved_red, need_opp, need_own)
+            if ejected is None:                 # the same material, solved together with this table
+                if reversible:
+                    child = ko_node(child, moved_opp, moved, moved_red, need_opp, need_own, (opp, own, red))
+                children.append(child)
+                continue
+            outcome, plies = decode(values[child])  # a push that ejects a marble leaves no ko
+            if outcome == LOSS:
+                win = plies + 1 if win is None else min(win, plies + 1)
+            elif outcome == WIN:
+                longest_win = max(longest_win, plies)
+            else:
+                draws += 1
+        for child in children:
+            preds[child].append(node)
+        if win is not None:
+            remaining[node] = None
+            buckets[win].append((node, WIN))
+        else:
+            remaining[node] = len(children) + draws
+            longest[node] = longest_win
+            if remaining[node] == 0:            # every move loses, or there are none
+                buckets[longest_win + 1].append((node, LOSS))
+
+    solved = 0
+    for table in group:
+        cap = table[2] + 1
+        for own, opp, red in layout.boards(table):
+            moves = list(successors(own, opp, red))
+            for need_own in range(1, cap + 1):
+                for need_opp in range(1, cap + 1):
+                    expand(layout.index(own, opp, red, need_own, need_opp), own, opp, red, need_own, need_opp, moves)
+                    solved += 1
+    while pending:
+        node, own, opp, red, need_own, need_opp, forbidden = pending.pop()
+        expand(node, own, opp, red, need_own, need_opp, list(successors(own, opp, red)), forbidden)
+
+    def value(node):
+        return values[node] if node < layout.size else ko_values[node - layout.size]
+
+    plies = 0
+    while buckets:
+        for node, outcome in buckets.pop(plies, ()):
+            if value(node):
+                continue
+            if plies > MAX_PLIES:
+                raise ValueError(f"distance {plies} does not fit in a byte")
+            if node < layout.size:
+                values[node] = (plies + 1) * outcome
+            else:
+                ko_values[node - layout.size] = (plies + 1) * outcome
+            for pred in preds.pop(node, ()):
+                if value(pred) or remaining[pred] is None:
+                    continue
+                if outcome == LOSS:
+                    remaining[pred] = None
+                    buckets[plies + 1].append((pred, WIN))
+                else:
+                    remaining[pred] -= 1
+                    longest[pred] = max(longest[pred], plies)
+                    if remaining[pred] == 0:
+                        buckets[longest[pred] + 1].append((pred, LOSS))
+        plies += 1
+    return solved
+
+
+def write(path, layout, values):
+    """Save a generated tablebase"""
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, layout.max_marbles, layout.max_reds))
+        file.write(values.tobytes())
+
+
+class Tablebase:
+    """A memory-mapped tablebase file. probe(game) looks a KubaGame or BitboardKubaGame position up in O(1)"""
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, max_marbles, max_reds = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} Kuba tablebase")
+        self.layout = Layout(max_marbles, max_reds)
+        self.values = memoryview(self.data)[HEADER.size:].cast("b")
+        if len(self.values) != self.layout.size:
+            raise ValueError(f"{path} is {len(self.values)} bytes, expected {self.layout.size}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmap and close the file"""
+        self.values.release()
+        self.data.close()
+        self.file.close()
+
+    def covers(self, own_count, opp_count, reds):
+        """Return True if positions with this material are in the table"""
+        return (1 <= own_count <= self.layout.max_marbles and 1 <= opp_count <= self.layout.max_marbles
+                and reds <= self.layout.max_reds)
+
+    def probe_masks(self, own, opp, red, need_own, need_opp):
+        """Return (WIN, LOSS or DRAW, plies) for the side to move with the own marbles, or None if the material is
+        not covered"""
+        reds = bin(red).count("1")
+        if not self.covers(bin(own).count("1"), bin(opp).count("1"), reds):
+            return None
+        cap = reds + 1
+        return decode(self.values[self.layout.index(own, opp, red, min(need_own, cap), min(need_opp, cap))])
+
+    def probe(self, game):
+        """Return (WIN, LOSS or DRAW, plies) for the side to move in game, or None if the game is over, is not on a
+        7x7 board, the material is not covered or the ko rule rules out a move"""
+        if game.get_winner() is not None or game.ko_hash is not None or getattr(game, "size", ROWS) != ROWS:
+            return None
+        white, black, reds = game.get_marble_count()
+        player = game.get_current_turn()
+        opponent = game.player2 if player == game.player1 else game.player1
+        own_colour, own_count, opp_count = ("W", white, black) if player == game.player1 else ("B", black, white)
+        if not self.covers(own_count, opp_count, reds):
+            return None
+        own = opp = red = 0
+        for cell in range(CELLS):
+            marble = game.get_marble(divmod(cell, COLS))
+            if marble == own_colour:
+                own |= 1 << cell
+            elif marble == "R":
+                red |= 1 << cell
+            elif marble != "X":
+                opp |= 1 << cell
+        return self.probe_masks(own, opp, red, WIN_REDS - game.get_captured(player),
+                                WIN_REDS - game.get_captured(opponent))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a Kuba endgame tablebase")
+    parser.add_argument("path")
+    parser.add_argument("--marbles", type=int, default=1, help="most marbles per side")
+    parser.add_argument("--reds", type=int, default=1, help="most red marbles")
+    args = parser.parse_args()
+
+    def progress(group, solved, seconds):
+        print(f"{' '.join('%d-%d-%d' % table for table in group):<12} {solved:>10,} positions in {seconds:.1f}s")
+
+    start = time.perf_counter()
+    layout, values = generate(args.marbles, args.reds, progress)
+    write(args.path, layout, values)
+    outcomes = collections.Counter(decode(value)[0] for value in values)
+    print(f"{layout.size:,} bytes written in {time.perf_counter() - start:.1f}s: {outcomes[WIN]:,} wins, "
+          f"{outcomes[LOSS]:,} losses, {outcomes[DRAW]:,} draws or unused slots")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Description: Zobrist hashing for Kuba positions and a bounded transposition table keyed by those hashes. Both
+# KubaGame and BitboardKubaGame use the same keys, so the same position hashes to the same value in either engine and
+# any search or analysis tool can share cached results through one TranspositionTable.
+
+import random
+
+ROWS, COLS = 7, 7
+MASK64 = (1 << 64) - 1
+MAX_CAPTURES = 64                   # captures position_key has keys for, see KubaGame for the board sizes this allows
+
+_rng = random.Random(0x4B554241)    # fixed seed so hashes are stable between runs and processes
+# PIECE_KEYS[cell][colour] for cell = row * COLS + column and colour "W", "B" or "R"
+PIECE_KEYS = [{colour: _rng.getrandbits(64) for colour in "WBR"} for _ in range(ROWS * COLS)]
+SIDE_KEY = _rng.getrandbits(64)                                     # xored in when Player2 is to move
+CAPTURE_KEYS = [[_rng.getrandbits(64) for _ in range(MAX_CAPTURES)] for _ in range(2)]
+KO_MULTIPLIER = _rng.getrandbits(64) | 1
+_SIZE_KEYS = {ROWS: PIECE_KEYS}
+
+
+def piece_keys(size):
+    """Return the PIECE_KEYS table for a size x size board, cell = row * size + column. The 7x7 table is PIECE_KEYS
+    itself, other sizes get keys from their own fixed seed the first time they are asked for"""
+    keys = _SIZE_KEYS.get(size)
+    if keys is None:
+        rng = random.Random(0x4B554241 + size)
+        keys = _SIZE_KEYS[size] = [{colour: rng.getrandbits(64) for colour in "WBR"} for _ in range(size * size)]
+    return keys
+
+
+def position_key(board_hash, player2_to_move, player1_points, player2_points, ko_hash):
+    """Combine the board hash with the side to move, both capture counts and the ko hash (the board hash a move is
+    not allowed to recreate) into the key used for transposition table lookups"""
+    key = board_hash ^ CAPTURE_KEYS[0][player1_points] ^ CAPTURE_KEYS[1][player2_points]
+    if player2_to_move:
+        key ^= SIDE_KEY
+    return key ^ ((ko_hash * KO_MULTIPLIER) & MASK64)
+
+
+EXACT, LOWER, UPPER = 0, 1, 2       # what an entry's value is: the exact score, a lower bound or an upper bound
+
+
+class TranspositionTable:
+    """Fixed size hash table of search results. Each key maps to one slot, and on a collision the new entry replaces
+    the old one if the old one came from an earlier search generation or was searched no deeper. Counts hits, misses,
+    stores and rejected stores"""
+    def __init__(self, size=1 << 18):
+        """Round size up to a power of two slots"""
+        slots = 1
+        while slots < size:
+            slots <<= 1
+        self.mask = slots - 1
+        self.slots = [None] * slots
+        self.generation = 0
+        self.filled = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return self.filled
+
+    def new_search(self):
+        """Start a new generation. Entries from older searches are replaced first"""
+        self.generation += 1
+
+    def clear(self):
+        """Empty the table and reset the counters"""
+        self.__init__(self.mask + 1)
+
+    def probe(self, key):
+        """Return (key, depth, value, flag, move, generation) stored for key, or None"""
+        entry = self.slots[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, value, flag=EXACT, move=None):
+        """Save a result for key, keeping whichever of it and the entry already in the slot is more useful"""
+        index = key & self.mask
+        old = self.slots[index]
+        if old is None:
+            self.filled += 1
+        elif old[0] != key and old[5] == self.generation and old[1] > depth:
+            self.rejected += 1
+            return
+        self.slots[index] = (key, depth, value, flag, move, self.generation)
+        self.stores += 1
+
+    def hit_rate(self):
+        """Return the fraction of probes that found their key"""
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+    def stats(self):
+        """Return the counters as a dict"""
+        return {"size": self.mask + 1, "filled": self.filled, "hits": self.hits, "misses": self.misses,
+                "stores": self.stores, "rejected": self.rejected, "hit_rate": self.hit_rate()}